@@ -5,19 +5,67 @@
 # Email: zpzhou@stanford.edu
 # Last Updated: 2020
 ##################################################################################
-import h5py
+import os
+import importlib
 
 from .core import *
-from .numeric import *
 from .container import *
 
 from .system import *
 
-from .color import *
-from .video import *
-from .html import *
-from .plot import *
-from .mpl import *
-
 from .timer import *
-from .logger import *
+
+# Heavy submodules (numpy, cv2, matplotlib, dominate, h5py) are imported on first access
+# to one of their names (PEP 562), so `import moka` for Dict or Timer stays cheap.
+# `from moka import *` still imports everything, in this order.
+_lazy_modules = ['numeric', 'color', 'store', 'video', 'html', 'plot', 'mpl', 'logger']
+_lazy_names = None
+
+
+def _top_level_names(module):
+    """Public names bound at the top level of a submodule, read from its source without importing it."""
+    import ast
+    with open(os.path.join(os.path.dirname(__file__), f'{module}.py')) as fp:
+        tree = ast.parse(fp.read())
+    names = set()
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.Assign):
+            names.update(t.id for t in node.targets if isinstance(t, ast.Name))
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            names.update((alias.asname or alias.name).split('.')[0] for alias in node.names if alias.name != '*')
+    return {name for name in names if not name.startswith('_')}
+
+
+def __getattr__(name):
+    if name == '__all__':
+        for module in _lazy_modules:
+            globals().update({k: v for k, v in vars(importlib.import_module(f'.{module}', __name__)).items()
+                              if not k.startswith('_')})
+        globals()['h5py'] = importlib.import_module('h5py')
+        return [k for k in globals() if not k.startswith('_') and k != 'importlib']
+    if name == 'h5py':
+        return importlib.import_module('h5py')
+
+    module = _lazy_index().get(name)
+    if module is None and name in _lazy_modules:
+        return importlib.import_module(f'.{name}', __name__)
+    if module is None:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+    value = getattr(importlib.import_module(f'.{module}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def _lazy_index():
+    global _lazy_names
+    if _lazy_names is None:
+        _lazy_names = dict()
+        for module in _lazy_modules:  # later modules shadow earlier ones, as with star imports
+            _lazy_names.update(dict.fromkeys(_top_level_names(module), module))
+    return _lazy_names
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_index()) | {'h5py'})
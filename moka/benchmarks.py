@@ -0,0 +1,58 @@
+# Benchmarks guarding moka's own performance. Not imported by the package,
+# so `python -m moka.benchmarks` runs it cleanly.
+
+##################################################################################
+def import_time(module='moka', repeat=5, budget=None):
+    """
+    Seconds to `import module` in a fresh interpreter (best of `repeat`), and the slowest
+    imports it pulled in, from `python -X importtime`. Fails if the time exceeds `budget`.
+    Run `python -m moka.benchmarks` to check that `import moka` stays lazy.
+    """
+    import sys, subprocess
+    best, slowest = None, None
+    for _ in range(repeat):
+        stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                capture_output=True, text=True, check=True).stderr
+        rows = [line.split('|') for line in stderr.splitlines() if line.startswith('import time:')][1:]
+        rows = [(int(cumulative) / 1e6, name.strip()) for _, cumulative, name in rows]
+        total = next(t for t, name in reversed(rows) if name == module)
+        if best is None or total < best:
+            best, slowest = total, sorted(rows, reverse=True)[1:6]
+    assert budget is None or best <= budget, \
+        f'import {module} took {best:.3f}s > {budget}s, slowest: ' + ', '.join(f'{n} {t:.3f}s' for t, n in slowest)
+    return best, slowest
+
+
+def bench_records(n=100000, repeat=5):
+    """Microseconds per operation for Dict, Record and a record() class; returns {op: {type: us}}."""
+    import timeit
+    from moka.core import Dict, Record, record
+
+    Point = record('Point', ['x', 'y', 'z'])
+    makers = {'Dict': lambda: Dict(x=1, y=2, z=3), 'Record': lambda: Record(x=1, y=2, z=3), 'record': lambda: Point(1, 2, 3)}
+    results = dict()
+    for kind, make in makers.items():
+        r = make()
+        ops = {
+            'create': make,
+            'getattr': lambda: r.x,
+            'getitem': lambda: r['y'],
+            'setattr': lambda: setattr(r, 'z', 4),
+            'contains': lambda: 'x' in r,
+            'get': lambda: r.get('w', None),
+            'items': lambda: list(r.items()),
+        }
+        for op, fn in ops.items():
+            best = min(timeit.repeat(fn, number=n, repeat=repeat))
+            results.setdefault(op, dict())[kind] = best / n * 1e6
+    return results
+
+
+if __name__ == '__main__':
+    best, slowest = import_time(budget=0.25)
+    print(f'import moka: {best:.3f}s')
+    for t, name in slowest:
+        print(f'  {name}: {t:.3f}s')
+    print('us/op'.ljust(10) + ''.join(kind.rjust(10) for kind in ['Dict', 'Record', 'record']))
+    for op, times in bench_records().items():
+        print(op.ljust(10) + ''.join(f'{t:10.3f}' for t in times.values()))
@@ -41,4 +41,152 @@ class Dict(object):
             setattr(self, k, v)
 
     def get(self, key, default_value):
-        return vars(self).get(key, default_value)
\ No newline at end of file
+        return vars(self).get(key, default_value)
+
+##################################################################################
+class Record(dict):
+    """
+    A dict with attribute access: r.key is r['key']. Being a real dict, item lookups, `in`, iteration,
+    len, json and pickle all run at dict speed. Attribute reads go through __getattr__ after a failed
+    instance lookup and are several times slower than Dict's; use record() for hot attribute access.
+    Nested dicts are converted with Record.convert and back with to_dict.
+    =============================================================================
+    Example usage:
+
+    >>> cfg = Record.convert({'model': {'depth': 18}, 'lr': 1e-3})
+    >>> cfg.model.depth += 16
+    >>> json.dumps(cfg.to_dict())
+    """
+    __slots__ = ()
+
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+    def __delattr__(self, key):
+        try:
+            del self[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def __dir__(self):
+        return list(super().__dir__()) + [k for k in self if isinstance(k, str)]
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict.__repr__(self)})'
+
+    def __reduce__(self):
+        return type(self), (dict(self),)
+
+    def copy(self):
+        return type(self)(self)
+
+    @classmethod
+    def convert(cls, obj):
+        """Recursively turn the dicts (and Dicts) in obj into Records, looking inside lists and tuples."""
+        if isinstance(obj, Dict): obj = vars(obj)
+        if isinstance(obj, dict):
+            return cls((k, cls.convert(v)) for k, v in obj.items())
+        if type(obj) in (list, tuple):
+            return type(obj)(cls.convert(x) for x in obj)
+        return obj
+
+    def to_dict(self):
+        """Recursive conversion back to plain dicts."""
+        return to_dict(self)
+
+
+def to_dict(obj):
+    if isinstance(obj, Dict): obj = vars(obj)
+    if hasattr(obj, '__record_fields__'): obj = dict(obj.items())
+    if isinstance(obj, dict):
+        return {k: to_dict(v) for k, v in obj.items()}
+    if type(obj) in (list, tuple):
+        return type(obj)(to_dict(x) for x in obj)
+    return obj
+
+
+_record_types = dict()
+
+def record(name, fields, defaults=()):
+    """
+    Fixed-schema record class with __slots__: no per-instance dict, so it is smaller and faster
+    to build than Record when millions are created. Supports attribute and item access,
+    the read-only Mapping protocol, to_dict and pickling (also of records of classes made here).
+    `defaults` apply to the last fields, as in namedtuple.
+    =============================================================================
+    Example usage:
+
+    >>> Job = record('Job', ['user', 'pid', 'command'], defaults=[''])
+    >>> j = Job('zpzhou', 42)
+    >>> j.command = 'python train.py'
+    >>> j['pid'], dict(j.items())
+    """
+    from collections.abc import Mapping
+
+    if isinstance(fields, str): fields = fields.replace(',', ' ').split()
+    fields, defaults = tuple(fields), tuple(defaults)
+    assert len(defaults) <= len(fields), (fields, defaults)
+    key = (name, fields, defaults)
+    if key in _record_types: return _record_types[key]
+
+    required = fields[:len(fields) - len(defaults)]
+    args = ', '.join(required + tuple(f'{k}=__defaults[{i}]' for i, k in enumerate(fields[len(required):])))
+    body = ''.join(f'\n    self.{k} = {k}' for k in fields) or '\n    pass'
+    namespace = {'__defaults': defaults}
+    exec(f'def __init__(self, {args}):{body}' if fields else f'def __init__(self):{body}', namespace)
+
+    names = frozenset(fields)
+
+    def __getitem__(self, key):
+        if key not in names: raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in names: raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        return iter(fields)
+
+    def __len__(self):
+        return len(fields)
+
+    def __contains__(self, key):
+        return key in names
+
+    def items(self):
+        return [(k, getattr(self, k)) for k in fields]
+
+    def values(self):
+        return [getattr(self, k) for k in fields]
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in names else default
+
+    def __eq__(self, other):
+        if isinstance(other, Mapping): return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self):
+        return f'{name}(' + ', '.join(f'{k}={getattr(self, k)!r}' for k in fields) + ')'
+
+    def __reduce__(self):
+        return _rebuild_record, (key, self.values())
+
+    cls = type(name, (Mapping,), dict(
+        __slots__=fields, __record_fields__=fields, __init__=namespace['__init__'],
+        __getitem__=__getitem__, __setitem__=__setitem__, __iter__=__iter__, __len__=__len__,
+        __contains__=__contains__, items=items, values=values, get=get, __eq__=__eq__, __hash__=None,
+        __repr__=__repr__, __reduce__=__reduce__, to_dict=to_dict))
+    _record_types[key] = cls
+    return cls
+
+
+def _rebuild_record(key, values):
+    return record(*key)(*values)
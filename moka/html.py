@@ -1,21 +1,114 @@
 import re
 import os, sys
-from collections import OrderedDict
+import json
+import threading
+import weakref
+import functools
+import itertools
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 import numpy as np
 from tqdm import tqdm
 
 import dominate
-from dominate.util import text
+from dominate.dom_tag import dom_tag
+from dominate.util import text, escape
 from dominate.tags import meta, h2, h3, table, tr, td, th, p, a, img, br, video, caption, link, style, br, span, thead, tbody
 
 from .core import *
+from .store import *
 from .video import *
 from .system import *
 from .mpl import *
 
 
+##################################################################################
+def locked(method):
+    """Hold the HTML lock while `method` edits the DOM, so an autosave never sees a half-built row."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with getattr(self, 'html', self).lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+INCREMENTAL_JS = """
+(function() {
+    // Only the bytes after `offset` are requested; servers without Range support send the
+    // whole feed (status 200) and the known prefix is skipped.
+    var offset = 0;
+    function poll() {
+        var headers = offset > 0 ? {'Range': 'bytes=' + offset + '-'} : {};
+        fetch('feed.jsonl', {cache: 'no-store', headers: headers}).then(function(r) {
+            if (r.status === 416) return null;  // nothing new
+            return r.arrayBuffer().then(function(data) { return [r.status, new Uint8Array(data)]; });
+        }).then(function(result) {
+            if (!result) return;
+            var bytes = result[0] === 206 ? result[1] : result[1].subarray(offset);
+            var end = bytes.lastIndexOf(10) + 1;
+            offset += end;
+            new TextDecoder().decode(bytes.subarray(0, end)).split('\\n').forEach(function(line) {
+                if (!line) return;
+                var e = JSON.parse(line);
+                var parent = e.parent ? document.getElementById(e.parent) : document.body;
+                parent.insertAdjacentHTML('beforeend', e.html);
+            });
+        });
+    }
+    poll();
+    if (%d > 0) setInterval(poll, %d * 1000);
+})();
+"""
+
+
+##################################################################################
+RE_SPAN_FULL = re.compile(r'(<span style="color:.*">.*</span>)')
+RE_SPAN_PART = re.compile(r'<span style="color:(.*)">(.*)</span>')
+SPAN_PREFIX = '<span style="color:'
+TEXT_OPEN = '<p style="line-height: 1.0; font-family: monospace">'
+
+
+def open_tag(name, attributes):
+    """Render an opening tag the way dominate does (sorted, escaped attributes)."""
+    return f'<{name}' + ''.join([f' {k}="{escape(str(v), True)}"' for k, v in sorted(attributes.items())]) + '>'
+
+
+class fast_td(dom_tag):
+    """
+    A <td> holding one pre-rendered child (a string, or a dominate tag for colored text).
+    Renders exactly like td(halign="center", valign="top", style=style) with that child,
+    without building the tree. Used by the 'fast' renderer.
+    """
+    tagname = 'td'
+
+    def __init__(self, content, style=None):
+        attributes = {'halign': 'center', 'valign': 'top'}
+        if style is not None: attributes['style'] = style
+        self.attributes = attributes
+        self.children = []
+        self.parent = None
+        self.html = open_tag('td', attributes)
+        self.content = content
+
+    def _render(self, sb, indent_level, indent_str, pretty, xhtml):
+        sb.append(self.html)
+        if self.content is not None:
+            if pretty:
+                sb.append('\n')
+                sb.append(indent_str * (indent_level + 1))
+            if isinstance(self.content, str):
+                sb.append(self.content)
+            else:
+                self.content._render(sb, indent_level + 1, indent_str, pretty, xhtml)
+            if pretty:
+                sb.append('\n')
+                sb.append(indent_str * indent_level)
+        sb.append('</td>')
+        return sb
+
+
 ##################################################################################
 class BaseHTML:
     """This HTML class allows us to save images and write texts into a single HTML file.
@@ -28,6 +121,7 @@ class BaseHTML:
         """Return the directory that stores images"""
         return self.img_dir
 
+    @locked
     def add_header(self, text):
         """Insert a header to the HTML file
 
@@ -37,6 +131,7 @@ class BaseHTML:
         with self.doc:
             h3(text)
 
+    @locked
     def add_images(self, ims, txts, links, width=400):
         """add images to the HTML file
 
@@ -59,11 +154,46 @@ class BaseHTML:
 
     def save(self, verbose=True):
         """save the current content to the HMTL file"""
-        html_file = '%s/index.html' % self.web_dir
+        with self.lock:
+            self.wait()
+            if self.incremental:
+                self.save_incremental()
+            else:
+                self.save_full()
+        if verbose: print(self)
+
+    def save_full(self):
+        html_file = '%s/%s' % (self.web_dir, self.page_file(self.page))
         f = open(html_file, 'wt')
         f.write(self.doc.render())
         f.close()
-        if verbose: print(self)
+
+    def save_incremental(self):
+        """Append only the elements added since the last save to feed.jsonl, then release them.
+        index.html is a static shell whose script fetches the feed and inserts new elements."""
+        # Containers are held weakly: once emitted and dropped by their table (e.g. a finished
+        # HTMLTable), nothing can add to them any more and they leave the list.
+        containers = [c for c in (ref() for ref in self.containers) if c is not None]
+        self.containers = [weakref.ref(c) for c in containers]
+        entries = []
+        for container in containers:
+            if not container.emitted: continue
+            parent = container.attributes.get('id')
+            for child in container.children:
+                html = child if isinstance(child, str) else child.render(pretty=False)
+                entries.append(json.dumps({'parent': parent, 'html': html}) + '\n')
+        for container in containers:
+            container.clear()
+            container.emitted = True
+
+        with open(f'{self.web_dir}/feed.jsonl', 'a' if self.feed_started else 'w') as f:
+            f.writelines(entries)
+
+        if not self.feed_started:
+            with open(f'{self.web_dir}/index.html', 'wt') as f:
+                f.write(f'{self.doc.doctype}\n<html>\n  {self.doc.head.render()}\n  <body>\n'
+                        f'    <script>{INCREMENTAL_JS % (self.refresh, self.refresh)}</script>\n  </body>\n</html>')
+            self.feed_started = True
 
 
 ##################################################################################
@@ -75,12 +205,28 @@ class HTML(BaseHTML):
 
      e.g. html = HTML('/something', 'My Awesome Page', base_url='www')
     """
-    def __init__(self, web_dir, title=None, refresh=0, overwrite=True, base_url='~/www', inverted=False):
+    def __init__(self, web_dir, title=None, refresh=0, overwrite=True, base_url='~/www', inverted=False,
+                 num_workers=0, dedup=False, rows_per_page=0, incremental=False, autosave=0, renderer='dominate',
+                 shared_ids=False):
         """Initialize the HTML classes
         Parameters:
             web_dir (str) -- a directory that stores the webpage. HTML file will be created at <web_dir>/index.html; images will be saved at <web_dir/images/
             title (str)   -- the webpage name
             refresh (int) -- how often the website refresh itself; if 0; no refreshing
+            num_workers (int) -- number of threads encoding images in the background; if 0, images are written synchronously.
+                                 Arrays handed to add_image must not be modified until save() or wait() returns.
+            dedup (bool/str)  -- store images and videos once by content hash in a store shared by all pages under
+                                 <base_url>/_store (or the given directory) instead of writing a file per cell
+            rows_per_page (int) -- if > 0, table rows are flushed to disk in pages of this many rows
+                                   (index.html, page_0001.html, ...) and their DOM is released
+            incremental (bool) -- save() only appends elements added since the last save to <web_dir>/feed.jsonl and
+                                  releases them; index.html fetches the feed (every `refresh` seconds), so it must be
+                                  served over http
+            autosave (float)   -- if > 0, save in a background thread every `autosave` seconds until close()
+            renderer (str)     -- 'dominate' builds a DOM tree per cell; 'fast' renders table cells from string
+                                  templates in one pass, with byte-identical output
+            shared_ids (bool)  -- allocate image/video ids through counter files in <web_dir>, so several processes
+                                  can populate the same directory without overwriting each other's files
         """
         if title is None:
             title = web_dir.split('/')[-1]
@@ -97,6 +243,26 @@ class HTML(BaseHTML):
         self.image_dir = self.img_dir
         self.video_dir = os.path.join(self.web_dir, 'videos')
         self.overwrite = overwrite
+        self.num_workers = num_workers
+        self.pool = None
+        self.pending = deque()
+        assert not (incremental and rows_per_page), 'incremental saves do not support pagination'
+        assert renderer in {'dominate', 'fast'}, renderer
+        self.renderer = renderer
+        self.rows_per_page = rows_per_page
+        self.incremental = incremental
+        self.refresh = refresh
+        self.lock = threading.RLock()
+        self.containers = []  # weak references
+        self.container_ids = itertools.count()
+        self.feed_started = False
+        self.page = 0
+        self.page_rows = 0
+        self.store = None
+        if dedup:
+            store_dir = dedup if isinstance(dedup, str) else \
+                        os.path.join(os.path.expanduser(base_url) if base_url is not None else self.web_dir, '_store')
+            self.store = BlobStore(store_dir)
         if not os.path.exists(self.web_dir):
             os.makedirs(self.web_dir)
         if not os.path.exists(self.img_dir):
@@ -104,6 +270,15 @@ class HTML(BaseHTML):
         if not os.path.exists(self.video_dir):
             os.makedirs(self.video_dir)
 
+        # Ids continue after the files already in the directory; it is only scanned once per page (or once per
+        # directory with shared_ids), never per table.
+        if shared_ids:
+            self.image_ids = FileCounter(f'{self.web_dir}/.image_id', lambda: len(os.listdir(self.img_dir)))
+            self.video_ids = FileCounter(f'{self.web_dir}/.video_id', lambda: len(os.listdir(self.video_dir)))
+        else:
+            self.image_ids = AtomicCounter(len(os.listdir(self.img_dir)))
+            self.video_ids = AtomicCounter(len(os.listdir(self.video_dir)))
+
         self.doc = dominate.document(title=title)
         with self.doc.head:
             link(rel='stylesheet', href='/css/main.css')
@@ -122,11 +297,81 @@ class HTML(BaseHTML):
             style(css)
             meta(charset='utf-8')
 
-        if refresh > 0:
+        if refresh > 0 and not incremental:
             with self.doc.head:
                 meta(http_equiv="refresh", content=str(refresh))
 
-
+        self.register(self.doc.main)
+
+        self.autosave_stop = threading.Event()
+        if autosave > 0:
+            threading.Thread(target=self.autosave, args=(autosave,), daemon=True).start()
+
+    def autosave(self, interval):
+        while not self.autosave_stop.wait(interval):
+            self.save(verbose=False)
+
+    def close(self, verbose=True):
+        """Stop autosaving and save a last time."""
+        self.autosave_stop.set()
+        self.save(verbose)
+
+    def register(self, container):
+        """In incremental mode, track `container` so children appended to it after a save are fed to the page."""
+        if not self.incremental: return
+        if container is not self.doc.main:
+            container['id'] = f'moka-{next(self.container_ids)}'
+        container.emitted = container is self.doc.main
+        self.containers.append(weakref.ref(container))
+
+
+    def submit(self, fn, *args):
+        """Run `fn(*args)` on the writer pool, or right away if num_workers == 0."""
+        if self.num_workers <= 0:
+            return fn(*args)
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(self.num_workers)
+        # Bound the backlog so pending arrays cannot pile up in memory.
+        while len(self.pending) >= 16 * self.num_workers:
+            self.pending.popleft().result()
+        self.pending.append(self.pool.submit(fn, *args))
+
+    def wait(self):
+        """Block until all pending image writes are done; re-raises their errors."""
+        while self.pending:
+            self.pending.popleft().result()
+
+    def page_file(self, page):
+        return 'index.html' if page == 0 else f'page_{page:04d}.html'
+
+    def next_rows(self, n=1):
+        """Account for `n` table rows about to be added; flushes the current page first if it is full."""
+        if self.rows_per_page > 0 and self.page_rows > 0 and self.page_rows + n > self.rows_per_page:
+            self.flush_page()
+        self.page_rows += n
+
+    def flush_page(self):
+        """Write the current page to disk and start an empty one, releasing the written DOM."""
+        self.nav(self.doc.footer, has_next=True)
+        self.save(verbose=False)
+        for container in [self.doc.header, self.doc.main, self.doc.footer]:
+            container.clear()
+        self.page += 1
+        self.page_rows = 0
+        self.nav(self.doc.header)
+        self.nav(self.doc.footer)
+
+    def nav(self, container, has_next=False):
+        container.clear()
+        with container:
+            with p(style='text-align:center;'):
+                if self.page > 0:
+                    a('prev', href=self.page_file(self.page - 1))
+                text(f' page {self.page + 1} ')
+                if has_next:
+                    a('next', href=self.page_file(self.page + 1))
+
+    @locked
     def h2(self, txt):
         """Insert a header to the HTML file
         Parameters:
@@ -135,24 +380,26 @@ class HTML(BaseHTML):
         with self.doc:
             h2(txt)
 
+    @locked
     def add(self, elem):
         self.doc.add(elem)
 
+    @locked
     def p(self, txt, center=False):
         with self.doc:
             kwargs = {} if not center else {'style': 'text-align:center;'}
             p(str(txt), **kwargs)
 
-    def add_table(self, transpose=False):
-        return HTMLTable(self) if not transpose else HTMLTableTranspose(self)
+    def add_table(self, transpose=False, **kwargs):
+        return HTMLTable(self, **kwargs) if not transpose else HTMLTableTranspose(self, **kwargs)
 
-    def add_bigtable(self, ncols):
-        return HTMLBigTable(self, ncols)
+    def add_bigtable(self, ncols, **kwargs):
+        return HTMLBigTable(self, ncols, **kwargs)
 
     def add_video(self, video, title='video', width=None):
         T = self.add_table()
         T.set_widths({title: width})
-        T.add_row({title: Video(video)})
+        T.add_row({title: video if isinstance(video, VideoWriter) else Video(video)})
 
     def url(self, domain=None):
         if domain is None:
@@ -163,7 +410,7 @@ class HTML(BaseHTML):
         return url
 
     def show(self, domain=None):
-        os.system(f'chromium-browser {self.url(domain)}')
+        shell(['chromium-browser', self.url(domain)], verbose=False)
 
     def __repr__(self):
         try:
@@ -191,6 +438,12 @@ class HTMLTable:
     >>> T.add([row for _ in range(10)])     # Adds 10 rows
     >>> html.save()
 
+    Images are written as lossless png by default; `ext`, `quality`, `downscale` and `lazy`
+    set the table defaults and `set_image_options` overrides them per column:
+
+    >>> T = html.add_table(ext='jpg', quality=90, lazy=True)
+    >>> T.set_image_options(im=dict(ext='webp', downscale=True))
+
     ~/www$ python3 -m http.server 8080
     ===> open http://localhost:8080/bla/ in browser:
 
@@ -203,17 +456,25 @@ class HTMLTable:
     +---+-----------------------------+-------------------------------+
     ...
     """
-    def __init__(self, html=None):
-        if html is None: html = HTML('.', '', overwrite=True)
+    def __init__(self, html=None, num_workers=0, ext='png', quality=None, downscale=False, lazy=False):
+        """
+        Parameters:
+            ext (str)           -- image format: 'png', 'jpg' or 'webp'
+            quality (int)       -- png compression level (0-9) or jpg/webp quality (0-100); None for opencv defaults
+            downscale (bool)    -- shrink images wider than their displayed width; a number scales the target width (e.g. 2 for HiDPI)
+            lazy (bool)         -- emit <img loading="lazy"> so the browser only fetches visible images
+        """
+        if html is None: html = HTML('.', '', overwrite=True, num_workers=num_workers)
         self.html = html
         self.header = None
-        self.t = table(border=1)
-        self.html.doc.add(self.t)
+        with self.html.lock:
+            self.t = table(border=1)
+            self.html.register(self.t)
+            self.html.doc.add(self.t)
         self.widths = dict()
-        self.num_images = 0
-        self.num_videos = 0
-        self.start_im_id = len(os.listdir(html.image_dir))
-        self.start_vd_id = len(os.listdir(html.video_dir))
+        self.image_options = dict(ext=ext, quality=quality, downscale=downscale, lazy=lazy)
+        self.column_image_options = dict()
+        self.page = html.page
 
 
     def parse_args(self, *args, **kwargs):
@@ -240,15 +501,15 @@ class HTMLTable:
 
 
     def add_text(self, value):
-        # FIXME(zpzhou): ugly! remove this hack when have time.
-        re_full = r'(<span style="color:.*">.*</span>)'
-        re_part = r'<span style="color:(.*)">(.*)</span>'
-
         value = str(value)
-        with p(style="line-height: 1.0; font-family: monospace"):
+        if self.html.renderer == 'fast' and SPAN_PREFIX not in value:
+            return TEXT_OPEN + ''.join([escape(line) + '<br>' for line in value.split('\n')]) + '</p>'
+
+        # FIXME(zpzhou): ugly! remove this hack when have time.
+        with p(style="line-height: 1.0; font-family: monospace") as paragraph:
             for line in value.split('\n'):
-                for part in re.split(re_full, line):
-                    found = re.findall(re_part, part)
+                for part in RE_SPAN_FULL.split(line):
+                    found = RE_SPAN_PART.findall(part)
                     if found:
                         color, txt = found[0]
                         if color == 'red': color = '#DC6A73'
@@ -258,45 +519,79 @@ class HTMLTable:
                     else:
                         text(part)
                 br()
+        return paragraph
 
 
-    def add_image(self, value, width=400):
+    def add_image(self, value, width=400, **options):
         # value can be path to image or bgr array
-        im_dir = self.html.image_dir
-        im_id = self.start_im_id + self.num_images
-        im_path = f'{im_id:06d}.png'
-        im_abs_path = f'{im_dir}/{im_path}'
-        im_rel_path = f'images/{im_path}'
-        
-        if isinstance(value, str):
-            value = cv2.imread(value)
-            cv2.imwrite(im_abs_path, value)
-        
-        elif isinstance(value, np.ndarray):
-            cv2.imwrite(im_abs_path, value)
-        
+        options = {**self.image_options, **options}
+        ext = IMAGE_EXTS[options['ext']]
+        downscale = options['downscale']
+        max_width = None if not downscale else int(width * downscale)
+
+        def new_path():
+            im_path = f'{self.html.image_ids.next():06d}.{ext}'
+            return f'{self.html.image_dir}/{im_path}', f'images/{im_path}'
+
+        if isinstance(value, (str, np.ndarray)) and self.html.store is not None:
+            store = self.html.store
+            extra = (ext, options['quality'], max_width)
+            digest = store.file_digest(value, *extra) if isinstance(value, str) else array_digest(value, *extra)
+            im_abs_path = store.path(digest, f'.{ext}')
+            im_rel_path = os.path.relpath(im_abs_path, self.html.web_dir)
+            if store.claim(im_abs_path):
+                self.html.submit(store.write, im_abs_path,
+                                 lambda tmp: save_image(value, tmp, options['quality'], max_width))
+
+        elif isinstance(value, (str, np.ndarray)):
+            im_abs_path, im_rel_path = new_path()
+            self.html.submit(save_image, value, im_abs_path, options['quality'], max_width)
+
         elif isinstance(value, matplotlib.legend.Legend):
+            im_abs_path, im_rel_path = new_path()
             export_legend(value, im_abs_path)
 
         else:
             raise ValueError(f'Unsupported image type: `{type(value)}`')
 
-        img(style=f"width:{width}px", src=im_rel_path)
-        self.num_images += 1
+        attributes = dict(style=f"width:{width}px", src=im_rel_path)
+        if options['lazy']: attributes['loading'] = 'lazy'
+        if self.html.renderer == 'fast':
+            return open_tag('img', attributes)
+        return img(**attributes)
 
 
     def add_video(self, value, width=None):
-        if isinstance(value, str):
+        store = self.html.store
+
+        if isinstance(value, str) and store is not None:
+            vd_abs_path = store.put_file(value)
+            vd_rel_path = os.path.relpath(vd_abs_path, self.html.web_dir)
+            if width is None: width = 400
+
+        elif isinstance(value, str):
             filename = value.replace('/', '_')
-            os.system(f'cp {value} {self.html.video_dir}/{filename}')
+            copyfile(value, f'{self.html.video_dir}/{filename}')
             vd_abs_path = f'{self.html.video_dir}/{filename}'
             vd_rel_path = f'videos/{filename}'
             if width is None: width = 400
 
+        elif isinstance(value, Video) and store is not None:
+            assert len(value) > 0, 'Empty video!'
+            digests = [array_digest(x) if isinstance(x, np.ndarray) else store.file_digest(x) for x in value]
+            vd_abs_path = store.path(combine_digests(digests, 20), '.mp4')
+            vd_rel_path = os.path.relpath(vd_abs_path, self.html.web_dir)
+
+            if width is None:
+                width = value[0].shape[1]
+
+            if store.claim(vd_abs_path):
+                store.write(vd_abs_path, lambda tmp: save_video(tmp, value, fps=20, verbose=False))
+
         elif isinstance(value, Video):
             assert len(value) > 0, 'Empty video!'
             vd_dir = self.html.video_dir
-            vd_id = self.start_vd_id + self.num_videos
+            vd_id = self.html.video_ids.next()
             vd_path = f'{vd_id:06d}.mp4'
             vd_abs_path = f'{vd_dir}/{vd_path}'
             vd_rel_path = f'videos/{vd_path}'
@@ -305,15 +600,51 @@ class HTMLTable:
                 width = value[0].shape[1]
 
             save_video(vd_abs_path, value, fps=20, verbose=False)
-            self.num_videos += 1
+
+        elif isinstance(value, VideoWriter) and store is not None:
+            value.close()
+            vd_abs_path = store.put_file(value.filename)
+            vd_rel_path = os.path.relpath(vd_abs_path, self.html.web_dir)
+
+            if width is None:
+                width = value.size[0]
+
+        elif isinstance(value, VideoWriter):
+            value.close()
+            vd_dir = self.html.video_dir
+            vd_id = self.html.video_ids.next()
+            vd_path = f'{vd_id:06d}.mp4'
+            vd_abs_path = f'{vd_dir}/{vd_path}'
+            vd_rel_path = f'videos/{vd_path}'
+
+            if width is None:
+                width = value.size[0]
+
+            value.save(vd_abs_path)
 
         # os.system(f'ffmpeg -y -loglevel error -i {vd_abs_path} -pix_fmt rgb24 {vd_abs_path.replace(".mp4", ".gif")}')
         # img(src=vd_rel_path.replace('.mp4', '.gif'), style=f"width:{width}px")
 
-        video(src=vd_rel_path, width=f'{width}px', height='auto', 
-              controls='true', autoplay='true', loop='true', muted='true', playsinline='true')
+        attributes = dict(src=vd_rel_path, width=f'{width}px', height='auto',
+                          controls='true', autoplay='true', loop='true', muted='true', playsinline='true')
+        if self.html.renderer == 'fast':
+            return open_tag('video', attributes) + '</video>'
+        return video(**attributes)
+
+
+    def add_cell(self, k, spec, v, prefix=''):
+        """Add the content of one cell; returns it as a string with the fast renderer."""
+        if spec in {'txt', 'int', 'float'}:
+            return self.add_text(f'{prefix}{v}')
 
+        elif spec in {'img'}:
+            return self.add_image(v, self.widths.get(k, 400), **self.column_image_options.get(k, {}))
 
+        elif spec in {'video'}:
+            return self.add_video(v, self.widths.get(k, 400))
+
+
+    @locked
     def set_header(self, *args, **kwargs):
         self.header = self.parse_args(*args, **kwargs)
 
@@ -329,7 +660,7 @@ class HTMLTable:
         for k, v in item.items():
             if isinstance(v, np.ndarray):
                 header[k] = 'img' if (v.ndim in {2, 3}) else 'int'
-            elif isinstance(v, Video):
+            elif isinstance(v, (Video, VideoWriter)):
                 header[k] = 'video'
             elif isinstance(v, int):
                 header[k] = 'int'
@@ -342,10 +673,37 @@ class HTMLTable:
         self.widths.update(self.parse_args(*args, **kwargs))
 
 
+    def set_image_options(self, *args, **kwargs):
+        """Per-column overrides of ext/quality/downscale/lazy, e.g. set_image_options(im=dict(ext='jpg'))"""
+        self.column_image_options.update(self.parse_args(*args, **kwargs))
+
+
+    def new_page(self):
+        """Continue this table on the HTML's current page, repeating the header."""
+        self.t = table(border=1)
+        self.html.doc.add(self.t)
+        self.page = self.html.page
+        if self.header: self.set_header(self.header)
+        return self
+
+
     def add_row(self, *args, **kwargs):
-        row = self.parse_args(*args, **kwargs)
+        return self.insert_row(self.parse_args(*args, **kwargs))
+
+
+    @locked
+    def insert_row(self, row):
+        """Add a row given as an already parsed (ordered) dict."""
+        self.html.next_rows()
+        if self.page != self.html.page: self.new_page()
         if not self.header: self.infer_header(row)
 
+        if self.html.renderer == 'fast':
+            self.t.add(tr([fast_td(self.add_cell(k, spec, row.get(k, ''), f'{k}:\n'),
+                                   None if k not in self.widths else f'width: {self.widths[k]}px')
+                           for k, spec in self.header.items()]))
+            return self
+
         with self.t:
             with tr() as table_row:
                 for k, spec in self.header.items():
@@ -354,15 +712,7 @@ class HTMLTable:
                                     else {'style': f'width: {self.widths[k]}px'}
 
                     with td(halign="center", valign="top", **td_style):
-
-                        if spec in {'txt', 'int', 'float'}:
-                            self.add_text(f'{k}:\n{v}')
-                        
-                        elif spec in {'img'}:
-                            self.add_image(v, self.widths.get(k, 400))
-                        
-                        elif spec in {'video'}:
-                            self.add_video(v, self.widths.get(k, 400))
+                        self.add_cell(k, spec, v, f'{k}:\n')
         return self
 
 
@@ -371,6 +721,40 @@ class HTMLTable:
             self.add_row(**item)
 
 
+    def add_columns(self, columns, no_tqdm=False, num_workers=None):
+        """
+        Add N rows given column-wise, e.g. {'im': uint8 array [N, H, W, 3], 'score': float array [N]},
+        or a pandas DataFrame. Images are zero-copy slices of the batch array, 1-D numeric columns
+        are formatted in one vectorized pass, and the header is inferred from the first row only.
+        If the HTML has no writer pool, images are written by `num_workers` threads (default: all cores)
+        and this call waits for them before returning.
+        """
+        if hasattr(columns, 'columns') and hasattr(columns, 'to_numpy'):
+            columns = OrderedDict((k, columns[k].to_numpy()) for k in columns.columns)
+
+        columns = OrderedDict(columns)
+        for k, values in columns.items():
+            if isinstance(values, np.ndarray) and values.ndim == 1 and values.dtype.kind in 'biuf':
+                # Widen floats so the strings match f'{v}' of each element, as in add().
+                if values.dtype.kind == 'f': values = values.astype(np.float64)
+                columns[k] = values.astype(str)
+        n = len(next(iter(columns.values())))
+        assert all(len(values) == n for values in columns.values()), {k: len(v) for k, v in columns.items()}
+
+        temporary_pool = self.html.num_workers <= 0
+        if temporary_pool: self.html.num_workers = num_workers or os.cpu_count()
+        try:
+            for i in tqdm(range(n), disable=no_tqdm):
+                self.insert_row(OrderedDict((k, values[i]) for k, values in columns.items()))
+        finally:
+            if temporary_pool:
+                self.html.num_workers = 0
+                self.html.wait()
+        return self
+
+    from_arrays = add_columns
+
+
     def __repr__(self):
         return self.t.render()
 
@@ -401,17 +785,25 @@ class HTMLTableTranspose(HTMLTable):
     | vid | <video src=videos/000000.mp4>| <video src=videos/000001.mp4> |
     +-----+------------------------------+-------------------------------+
     """
-    def __init__(self, html):
-        super(HTMLTableTranspose, self).__init__(html)
+    def __init__(self, html, **kwargs):
+        super(HTMLTableTranspose, self).__init__(html, **kwargs)
         self.table_rows = []
         self.heights = dict()
 
+    def new_page(self):
+        self.table_rows = []
+        return super(HTMLTableTranspose, self).new_page()
+
+    @locked
     def set_header(self, *args, **kwargs):
         self.header = self.parse_args(*args, **kwargs)
+        if self.page != self.html.page:
+            return self.new_page()  # rebuilds the header rows on the current page
 
         with self.t:
             for k in self.header:
                 table_row = tr()
+                self.html.register(table_row)
                 self.table_rows.append(table_row)
                 with table_row:
                     td(k)
@@ -420,10 +812,18 @@ class HTMLTableTranspose(HTMLTable):
     def set_heights(self, *args, **kwargs):
         self.heights.update(self.parse_args(*args, **kwargs))
 
+    @locked
     def add_col(self, *args, **kwargs):
         col = self.parse_args(*args, **kwargs)
+        if self.page != self.html.page: self.new_page()
         if not self.header: self.infer_header(col)
 
+        if self.html.renderer == 'fast':
+            for (k, spec), table_row in zip(self.header.items(), self.table_rows):
+                table_row.add(fast_td(self.add_cell(k, spec, col.get(k, '')),
+                                      None if k not in self.heights else f'height: {self.heights[k]}px'))
+            return self
+
         with self.t:
             for (k, spec), table_row in zip(self.header.items(), self.table_rows):
                 with table_row:
@@ -432,12 +832,7 @@ class HTMLTableTranspose(HTMLTable):
                                     else {'style': f'height: {self.heights[k]}px'}
 
                     with td(halign="center", valign="top", **td_style):
-                        if spec in {'txt', 'int', 'float'}:
-                            self.add_text(f'{v}')
-                        elif spec in {'img'}:
-                            self.add_image(v, self.widths.get(k, 400))
-                        elif spec in {'video'}:
-                            self.add_video(v, self.widths.get(k, 400))
+                        self.add_cell(k, spec, v)
         return self
 
 
@@ -472,10 +867,11 @@ class HTMLBigTable(HTMLTableTranspose):
     | vid | <video src=videos/000002.mp4>| <video src=videos/000003.mp4> |
     +-----+------------------------------+-------------------------------+
     """
-    def __init__(self, html=None, ncols=5):
-        super(HTMLBigTable, self).__init__(html)
+    def __init__(self, html=None, ncols=5, **kwargs):
+        super(HTMLBigTable, self).__init__(html, **kwargs)
         self.ncols = ncols
 
+    @locked
     def set_header(self, *args, **kwargs):
         self.header = self.parse_args(*args, **kwargs)
         return self
@@ -483,7 +879,9 @@ class HTMLBigTable(HTMLTableTranspose):
     def add(self, columns, no_tqdm=False, display=False):
         if display: no_tqdm = True
         for i in tqdm(range(0, len(columns), self.ncols), disable=no_tqdm):
-            T = self.html.add_table(transpose=True)
+            self.html.next_rows(min(self.ncols, len(columns) - i))
+            T = self.html.add_table(transpose=True, **self.image_options)
+            T.set_image_options(self.column_image_options)
             if self.header: T.set_header(**self.header)
             for column in columns[i : min(i + self.ncols, len(columns))]:
                 T.add_col(**column)
@@ -495,6 +893,28 @@ class HTMLBigTable(HTMLTableTranspose):
 
 
 ##################################################################################
+IMAGE_EXTS = {'png': 'png', 'jpg': 'jpg', 'jpeg': 'jpg', 'webp': 'webp'}
+
+
+def save_image(value, filename, quality=None, max_width=None):
+    """Write an image (path or bgr array) to `filename`, whose extension picks the format.
+    Images wider than `max_width` are downscaled. Runs on the HTML writer pool."""
+    if isinstance(value, str):
+        value = cv2.imread(value)
+
+    if max_width is not None and value.shape[1] > max_width:
+        height = max(1, round(value.shape[0] * max_width / value.shape[1]))
+        value = cv2.resize(value, (max_width, height), interpolation=cv2.INTER_AREA)
+
+    params = []
+    if quality is not None:
+        flag = {'png': cv2.IMWRITE_PNG_COMPRESSION,
+                'jpg': cv2.IMWRITE_JPEG_QUALITY,
+                'webp': cv2.IMWRITE_WEBP_QUALITY}[os.path.splitext(filename)[1][1:]]
+        params = [flag, int(quality)]
+    cv2.imwrite(filename, value, params)
+
+
 def display_html(html_str):
     import IPython.core.display as IPyDisp
     IPyDisp.display(IPyDisp.HTML(str(html_str)))
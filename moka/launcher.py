@@ -9,6 +9,9 @@ from tabulate import tabulate
 from .core import *
 from .system import *
 
+Job = record('Job', ['user', 'pid', 'cpu', 'mem', 'start_time', 'wall_time', 'command', 'moka_id', 'script'],
+             defaults=[None, None])
+
 
 if __name__ == '__main__':
     MARKER = '##'
@@ -31,9 +34,8 @@ if __name__ == '__main__':
 
         jobs = []
         for row in procs[1:]:
-            j = Dict()
-            j.user, j.pid, j.cpu, j.mem, *_, j.start_time, j.wall_time, j.command = row.split(None, nfields)
-            j.command = j.command.strip()
+            user, pid, cpu, mem, *_, start_time, wall_time, command = row.split(None, nfields)
+            j = Job(user, pid, cpu, mem, start_time, wall_time, command.strip())
             if j.user != g.USER: continue
             jobs.append(j)
 
@@ -93,7 +95,7 @@ if __name__ == '__main__':
         if CMD == '--':
             file = f'configs/{TARGET}.sh'
             if (not os.path.isfile(file)) or ask(f'File {file} exists. Overwrite?'):
-                shell(f'cp configs/{EXP}.sh {file}', verbose=False)
+                copyfile(f'configs/{EXP}.sh', file)
 
         elif CMD not in config:
             raise ValueError(f'Command "{CMD}" not found in experiment {EXP} ({config_path})!')
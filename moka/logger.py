@@ -1,8 +1,17 @@
 import os, sys
+import json
+import time
+import queue
+import atexit
+import shutil
+import threading
 from glob import glob
-from pprint import pprint
+from fnmatch import fnmatch
+from pprint import pprint, pformat
+from contextlib import nullcontext
 from datetime import datetime
 from collections import defaultdict
+from urllib.parse import quote, unquote
 
 import numpy as np
 from tabulate import tabulate
@@ -11,35 +20,262 @@ from .system import *
 
 
 ##################################################################################
-class Statistics(object):
+class Running(object):
+    """Weighted count, sum, mean, variance (Welford/West), min and max of a stream in O(1) memory."""
+    __slots__ = ('count', 'weight', 'mean', 'm2', 'min', 'max')
+
     def __init__(self):
+        self.count, self.weight, self.mean, self.m2 = 0, 0.0, 0.0, 0.0
+        self.min, self.max = float('inf'), float('-inf')
+
+    def add(self, v, w=1):
+        self.count += 1
+        self.weight += w
+        delta = v - self.mean
+        self.mean = self.mean + delta * (w / self.weight) if self.weight else self.mean
+        self.m2 = self.m2 + w * delta * (v - self.mean)
+        if isinstance(v, (int, float)):
+            lo = hi = v
+        else:
+            lo, hi = np.min(v), np.max(v)
+        if lo < self.min: self.min = lo
+        if hi > self.max: self.max = hi
+
+    @property
+    def sum(self):
+        return self.mean * self.weight
+
+    @property
+    def var(self):
+        return self.m2 / self.weight if self.weight else float('nan')
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+
+class EMA(object):
+    """Exponential moving average; a value of weight w counts as w steps of decay `alpha`."""
+    __slots__ = ('alpha', 'value')
+
+    def __init__(self, alpha=0.1):
+        self.alpha = alpha
+        self.value = None
+
+    def add(self, v, w=1):
+        if self.value is None:
+            self.value = v
+        else:
+            a = self.alpha if w == 1 else 1 - (1 - self.alpha) ** w
+            self.value = self.value + a * (v - self.value)
+
+
+class Window(object):
+    """The last `size` scalar values and weights, in preallocated ring buffers."""
+    def __init__(self, size=100):
+        self.values = np.zeros(size)
+        self.weights = np.zeros(size)
+        self.index = 0
+        self.count = 0
+
+    def add(self, v, w=1):
+        self.values[self.index] = v
+        self.weights[self.index] = w
+        self.index = (self.index + 1) % len(self.values)
+        self.count = min(self.count + 1, len(self.values))
+
+    @property
+    def mean(self):
+        n = self.count
+        return np.sum(self.values[:n] * self.weights[:n]) / np.sum(self.weights[:n]) if n else float('nan')
+
+    @property
+    def min(self):
+        return np.min(self.values[:self.count]) if self.count else float('nan')
+
+    @property
+    def max(self):
+        return np.max(self.values[:self.count]) if self.count else float('nan')
+
+
+class QuantileSketch(object):
+    """
+    Mergeable streaming quantiles (KLL sketch) of scalar values, in about 3k items of memory.
+    Level h holds items standing for 2^h values each; a full level is sorted and every other
+    item (random offset) is promoted to the next one. With k=200, rank errors stay under ~0.5%.
+    Weights are ignored: quantiles are over the values added.
+    """
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.levels = [[]]
+        self.count = 0
+        self.size = 0
+        self.max_size = self.capacity(0)
+        self.rng = np.random.default_rng(seed)
+
+    def capacity(self, h):
+        # Lower levels shrink geometrically, so most of the memory goes to the top ones.
+        return max(2, int(np.ceil(self.k * (2 / 3) ** (len(self.levels) - 1 - h))))
+
+    def add(self, v, w=1):
+        self.levels[0].append(v)
+        self.count += 1
+        self.size += 1
+        if self.size >= self.max_size:
+            self.compress()
+
+    def compress(self):
+        # Lazy: compact only the lowest full level, and only while the sketch as a whole is full.
+        while self.size >= self.max_size:
+            h = next(h for h in range(len(self.levels)) if len(self.levels[h]) >= self.capacity(h))
+            if h + 1 == len(self.levels): self.levels.append([])
+            level = sorted(self.levels[h])
+            keep = [level.pop()] if len(level) % 2 else []
+            self.levels[h + 1].extend(level[self.rng.integers(2)::2])
+            self.levels[h] = keep
+            self.size = sum(map(len, self.levels))
+            self.max_size = sum(map(self.capacity, range(len(self.levels))))
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels): self.levels.append([])
+        for h, level in enumerate(other.levels):
+            self.levels[h].extend(level)
+        self.count += other.count
+        self.size = sum(map(len, self.levels))
+        self.max_size = sum(map(self.capacity, range(len(self.levels))))
+        self.compress()
+        return self
+
+    def quantile(self, q):
+        """Value at quantile q in [0, 1] (or a list of them)."""
+        if self.count == 0: return float('nan') if np.isscalar(q) else [float('nan')] * len(q)
+        values = np.concatenate([np.asarray(level, dtype=float) for level in self.levels])
+        weights = np.concatenate([np.full(len(level), 2.0 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(values)
+        cdf = np.cumsum(weights[order])
+        i = np.searchsorted(cdf, np.asarray(q) * cdf[-1], side='left')
+        return values[order][np.minimum(i, len(values) - 1)]
+
+
+class Statistics(object):
+    """
+    Per-key weighted statistics. Running aggregates make mean/min/max/std O(1) per query.
+    With history=False only the aggregates are kept, so memory does not grow with the number
+    of values; with history=True (default) the raw values and weights are kept as well and
+    are available through stats[k] and items().
+
+    Keys can also track an exponential moving average (`ema` = decay), the mean/min/max of the
+    last `window` values, and `quantiles` from a streaming sketch. Set these for all keys here
+    or per key with track(); they appear in query(), summary(), to_string and log_tensorboard.
+    =============================================================================
+    Example usage:
+
+    >>> stats = Statistics(history=False, ema=0.05)
+    >>> stats.track('latency', window=100, quantiles=[0.5, 0.95, 0.99])
+    >>> stats.add('latency', dt)
+    >>> stats.query('latency', 'p99'), stats.query('latency', 'window')
+    """
+    def __init__(self, history=True, ema=None, window=None, quantiles=None):
+        self.history = history
+        self.defaults = dict(ema=ema, window=window, quantiles=quantiles)
+        self.specs = dict()
+        self.running = dict()
+        self.trackers = dict()
         self.d = defaultdict(list)
         self.w = defaultdict(list)
 
+    def track(self, k, ema=None, window=None, quantiles=None):
+        """Add aggregators to key k, on top of the defaults; must be called before its first add."""
+        assert k not in self.running, f'`{k}` already has values'
+        spec = dict(ema=ema, window=window, quantiles=quantiles)
+        self.specs[k] = {key: self.defaults[key] if spec[key] is None else spec[key] for key in spec}
+        return self
+
+    def create(self, k):
+        spec = self.specs.get(k, self.defaults)
+        trackers = dict()
+        if spec['ema'] is not None: trackers['ema'] = EMA(spec['ema'])
+        if spec['window'] is not None: trackers['window'] = Window(spec['window'])
+        if spec['quantiles'] is not None: trackers['quantiles'] = QuantileSketch()
+        self.trackers[k] = trackers
+        self.running[k] = Running()
+        return self.running[k]
+
     def add(self, k, v, w=1):
-        self.d[k].append(v)
-        self.w[k].append(w)
+        running = self.running.get(k)
+        if running is None: running = self.create(k)
+        running.add(v, w)
+        for tracker in self.trackers[k].values():
+            tracker.add(v, w)
+        if self.history:
+            self.d[k].append(v)
+            self.w[k].append(w)
+
+    def query(self, k, stat='mean'):
+        """
+        One statistic of key k: 'mean', 'min', 'max', 'std', 'sum', 'count', 'ema', 'window'
+        (mean of the window), 'window_min', 'window_max', or a quantile as 'p95' / 'p99.9' / 0.95.
+        """
+        trackers = self.trackers[k]
+        if isinstance(stat, float) or stat[0] == 'p':
+            assert 'quantiles' in trackers, f'`{k}` does not track quantiles'
+            return trackers['quantiles'].quantile(stat if isinstance(stat, float) else float(stat[1:]) / 100)
+        if stat == 'ema':
+            assert 'ema' in trackers, f'`{k}` does not track an EMA'
+            return trackers['ema'].value
+        if stat.startswith('window'):
+            assert 'window' in trackers, f'`{k}` does not track a window'
+            return getattr(trackers['window'], stat[7:] or 'mean')
+        return getattr(self.running[k], stat)
+
+    def summary(self, k):
+        """All statistics tracked for key k, as {name: value}."""
+        trackers = self.trackers[k]
+        stats = ['mean', 'max', 'min']
+        if 'ema' in trackers: stats.append('ema')
+        if 'window' in trackers: stats.append('window')
+        if 'quantiles' in trackers: stats += [f'p{100 * q:g}' for q in self.specs.get(k, self.defaults)['quantiles']]
+        return {stat: self.query(k, stat) for stat in stats}
 
     def mean(self, k):
-        d = np.array(self.d[k])
-        w = np.array(self.w[k])
-        return np.sum(d * w) / np.sum(w)
+        return self.running[k].mean
 
     def min(self, k):
-        return np.min(self.d[k])
+        return self.running[k].min
 
     def max(self, k):
-        return np.max(self.d[k])
+        return self.running[k].max
+
+    def std(self, k):
+        return self.running[k].std
+
+    def sum(self, k):
+        return self.running[k].sum
+
+    def count(self, k):
+        return self.running[k].count
 
     def __getitem__(self, k):
+        assert self.history, 'raw values are only kept with history=True'
         assert k in self.d
         return self.d[k], self.w[k]
 
     def __setitem__(self, k, v):
-        self.d[k], self.w[k] = v
+        assert self.history, 'raw values are only kept with history=True'
+        values, weights = v
+        self.d[k], self.w[k] = values, weights
+        running = self.create(k)
+        trackers = self.trackers[k].values()
+        for value, weight in zip(values, weights):
+            running.add(value, weight)
+            for tracker in trackers:
+                tracker.add(value, weight)
+
+    def __contains__(self, k):
+        return k in self.running
 
     def __iter__(self):
-        for k in self.d: yield k
+        for k in self.running: yield k
 
     def __repr__(self):
         return self.to_string()
@@ -48,66 +284,359 @@ class Statistics(object):
         if not verbose:
             return '[' + ', '.join([f'{k} = {self.mean(k)}' for k in self]) + ']'
         else:
-            data = []
-            for k in self:
-                data.append([k, self.mean(k), self.max(k), self.min(k)])
-            return '\n\n' + tabulate(data, headers=['Metric', 'Average', 'Max', 'Min'], tablefmt="fancy_grid") + '\n\n'
+            summaries = {k: self.summary(k) for k in self}
+            headers = list(dict.fromkeys(stat for summary in summaries.values() for stat in summary))
+            data = [[k] + [summary.get(stat, '') for stat in headers] for k, summary in summaries.items()]
+            names = {'mean': 'Average', 'max': 'Max', 'min': 'Min', 'ema': 'EMA', 'window': 'Window'}
+            headers = ['Metric'] + [names.get(stat, stat) for stat in headers]
+            return '\n\n' + tabulate(data, headers=headers, tablefmt="fancy_grid") + '\n\n'
 
     def items(self):
+        assert self.history, 'raw values are only kept with history=True'
         return self.d.items()
 
-    def log_tensorboard(self, tb, step):
+    def scalars(self):
+        """The mean of each key as `k`, and its other tracked statistics as `k/ema`, `k/p95`, ..."""
+        scalars = dict()
         for k in self:
-            tb.add_scalar(k, self.mean(k), step)
+            scalars[k] = self.mean(k)
+            for stat, value in self.summary(k).items():
+                if stat not in ('mean', 'min', 'max'):
+                    scalars[f'{k}/{stat}'] = value
+        return scalars
+
+    def log_tensorboard(self, tb, step):
+        for k, value in self.scalars().items():
+            tb.add_scalar(k, value, step)
+
+    def log(self, sink, step):
+        """Write scalars() as one record of a structured log (see open_sink)."""
+        sink.write(dict(step=step, time=time.time(), **self.scalars()))
+
+
+##################################################################################
+class JSONLSink(object):
+    """Structured log as one JSON object per line. Lines are buffered by the file and flushed on flush()/close()."""
+    def __init__(self, filename, mode='a'):
+        mkdir(os.path.dirname(filename) or '.')
+        self.filename = filename
+        self.fout = open(filename, mode, buffering=1 << 16)
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def write(self, record):
+        line = json.dumps(record, default=to_json) + '\n'
+        with self.lock:
+            self.fout.write(line)
+
+    def flush(self):
+        with self.lock:
+            self.fout.flush()
+
+    def close(self):
+        atexit.unregister(self.close)
+        with self.lock:
+            if not self.fout.closed: self.fout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class HDF5Sink(object):
+    """
+    Append-only columnar log in HDF5. Rows (records) get a global index, with their `step` and
+    `time` in the /step and /time datasets; each other key is a group with a `value` column
+    and the `row` index each value belongs to, so keys may appear in any subset of the rows.
+    Rows are buffered and appended `chunk` at a time to chunked, resizable datasets.
+    Reopening an existing file continues it.
+    """
+    def __init__(self, filename, chunk=1024):
+        import h5py
+        mkdir(os.path.dirname(filename) or '.')
+        self.filename = filename
+        self.chunk = chunk
+        self.file = h5py.File(filename, 'a')
+        self.rows = len(self.file['step']) if 'step' in self.file else 0
+        self.pending = defaultdict(list)
+        self.num_pending = 0
+        self.dtypes = dict()  # key -> str, np.float64 or np.int64, fixed by the file or the first value
+        self.lock = threading.Lock()
+        atexit.register(self.close)  # rows still buffered would be lost otherwise
+
+    def write(self, record):
+        with self.lock:
+            row = self.rows + self.num_pending
+            values = {'step': record.get('step', row), 'time': record.get('time', time.time())}
+            values.update((k, v) for k, v in record.items() if k not in ('step', 'time'))
+            values = {k: self.convert(k, v) for k, v in values.items()}  # reject a bad row before buffering any of it
+            for k, v in values.items():
+                self.pending[k].append((row, v))
+            self.num_pending += 1
+            if self.num_pending >= self.chunk: self.write_pending()
+
+    def dtype(self, k, v):
+        """Type of column `k`, taken from the file or else from its first non-None value `v`."""
+        if k not in self.dtypes:
+            name = k if k in ('step', 'time') else f'{quote(k, safe="")}/value'
+            if name in self.file:
+                self.dtypes[k] = str if self.file[name].dtype.kind == 'O' else self.file[name].dtype.type
+            elif v is None:
+                return None
+            else:
+                self.dtypes[k] = np.int64 if k == 'step' else str if isinstance(v, str) else np.float64
+        return self.dtypes[k]
+
+    def convert(self, k, v):
+        dtype = self.dtype(k, v)
+        if v is None or dtype is None: return v
+        cast = str if dtype == str else int if np.issubdtype(dtype, np.integer) else float
+        try:
+            return cast(v)
+        except (TypeError, ValueError):
+            raise ValueError(f'cannot log {k}={v!r} in a {cast.__name__} column') from None
+
+    def dataset(self, name, dtype):
+        import h5py
+        if name not in self.file:
+            if dtype == str: dtype = h5py.string_dtype()
+            self.file.create_dataset(name, (0,), dtype=dtype, maxshape=(None,), chunks=(self.chunk,))
+        return self.file[name]
+
+    def append(self, name, values, dtype):
+        data = self.dataset(name, dtype)
+        n = len(data)
+        data.resize((n + len(values),))
+        data[n:] = values
+
+    def write_pending(self):
+        # Convert every column before appending any, so a failure cannot leave the datasets misaligned.
+        columns = []
+        for k, rows in self.pending.items():
+            values = [v for _, v in rows]
+            dtype = self.dtype(k, next((v for v in values if v is not None), None)) or np.float64
+            # missing values become '' or NaN
+            values = [('' if v is None else v) for v in values] if dtype == str else \
+                     np.asarray([(np.nan if v is None else v) for v in values], dtype)
+            columns.append((k, [row for row, _ in rows], values, dtype))
+        for k, rows, values, dtype in columns:
+            if k in ('step', 'time'):
+                self.append(k, values, dtype)
+            else:
+                name = quote(k, safe='')
+                self.append(f'{name}/row', rows, np.int64)
+                self.append(f'{name}/value', values, dtype)
+        self.rows += self.num_pending
+        self.pending.clear()
+        self.num_pending = 0
+
+    def flush(self):
+        with self.lock:
+            self.write_pending()
+            self.file.flush()
+
+    def close(self):
+        atexit.unregister(self.close)
+        with self.lock:
+            if not self.file: return
+            self.write_pending()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def to_json(obj):
+    """json.dumps fallback for numpy scalars and arrays."""
+    if isinstance(obj, np.generic): return obj.item()
+    if isinstance(obj, np.ndarray): return obj.tolist()
+    return str(obj)
+
+
+def open_sink(filename, **kwargs):
+    """JSONLSink or HDF5Sink, by extension (.jsonl, .h5 / .hdf5)."""
+    ext = os.path.splitext(filename)[1]
+    if ext in ('.h5', '.hdf5'): return HDF5Sink(filename, **kwargs)
+    assert ext in ('.jsonl', '.json'), f'Unknown log format `{ext}`'
+    return JSONLSink(filename, **kwargs)
+
+
+def load_metrics(filename):
+    """
+    Load a structured log as {key: (steps, values)} NumPy arrays. From HDF5 the columns are read
+    directly; a JSONL log is parsed once. Text values come back as object arrays.
+    =============================================================================
+    Example usage:
+
+    >>> steps, loss = load_metrics('logs/run1/metrics.h5')['loss']
+    """
+    if os.path.splitext(filename)[1] in ('.h5', '.hdf5'):
+        import h5py
+        with h5py.File(filename, 'r') as f:
+            if 'step' not in f: return dict()  # no rows written yet
+            steps = f['step'][:]
+            metrics = {'time': (steps, f['time'][:])}
+            for name in f:
+                if name in ('step', 'time'): continue
+                values = f[name]['value']
+                values = values.asstr()[:].astype(object) if h5py.check_string_dtype(values.dtype) else values[:]
+                metrics[unquote(name)] = (steps[f[name]['row'][:]], values)
+            return metrics
+
+    columns = defaultdict(lambda: ([], []))
+    with open(filename) as fp:
+        for row, line in enumerate(fp):
+            record = json.loads(line)
+            step = record.get('step', row)
+            for k, v in record.items():
+                if k == 'step': continue
+                columns[k][0].append(step)
+                columns[k][1].append(v)
+    return {k: (np.array(steps), np.array(values, dtype=object if isinstance(values[0], str) else None))
+            for k, (steps, values) in columns.items()}
 
 
 ##################################################################################
 class Printer(object):
-    def __init__(self, logfile=None, mode='w', stdout=True):
+    """
+    Timestamped logging to a file (and stdout). With buffered=True, lines are handed to a
+    background thread through a bounded queue of `queue_size` lines, which writes them in batches
+    and flushes once `buffer_size` characters are pending or every `flush_interval` seconds.
+    Pending lines are written by flush(), close(), and at interpreter exit, including after Ctrl-C.
+    With a `sink` (a filename for open_sink, or a sink), lines are also logged as {'time', 'text'}
+    records, and log() writes structured records to it.
+    =============================================================================
+    Example usage:
+
+    >>> printer = Printer('logs/train.log', buffered=True)
+    >>> for step in range(steps):
+    >>>     printer.fprint(f'step {step}: loss = {loss}')
+    """
+    def __init__(self, logfile=None, mode='w', stdout=True, buffered=False,
+                 flush_interval=1.0, buffer_size=1 << 16, queue_size=10000, sink=None):
         self.logfile = logfile
+        self.own_sink = isinstance(sink, str)
+        self.sink = open_sink(sink) if self.own_sink else sink
         self.fout = None
         self.mode = mode
+        self.buffered = buffered
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.queue_size = queue_size
+        self.queue = None
+        self.second, self.timestamp = None, None
         if stdout: print('Logging to:', self.logfile)
 
 
     def now(self):
-        return datetime.now().strftime('%b-%d-%y@%H:%M:%S')
+        # strftime is only called once per second.
+        second = int(time.time())
+        if second != self.second:
+            self.second, self.timestamp = second, f'{datetime.fromtimestamp(second).strftime("%b-%d-%y@%H:%M:%S"):25}'
+        return self.timestamp
 
 
     def open(self):
         if self.fout is None:
             mkdir(os.path.dirname(self.logfile))
             self.fout = open(self.logfile, self.mode)
+            if self.buffered:
+                self.queue = queue.Queue(self.queue_size)
+                self.thread = threading.Thread(target=self.write_loop, daemon=True)
+                self.thread.start()
+                atexit.register(self.close)
+
+
+    def write_loop(self):
+        pending = defaultdict(list)
+        size, last_flush = 0, time.time()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = False
+            if isinstance(item, tuple):
+                line, fps = item
+                for fp in fps:
+                    pending[fp].append(line)
+                size += len(line)
+            if item is False or item is None or isinstance(item, threading.Event) \
+                    or size >= self.buffer_size or time.time() - last_flush >= self.flush_interval:
+                for fp, lines in pending.items():
+                    if not lines: continue
+                    fp.write(''.join(lines))
+                    fp.flush()
+                    lines.clear()
+                size, last_flush = 0, time.time()
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is None:
+                break
+
+
+    def write(self, line, fps):
+        if self.queue is None:
+            for fp in fps:
+                fp.write(line)
+                fp.flush()
+        else:
+            self.queue.put((line, fps))
 
 
-    def fprint(self, *args, **kwargs):
+    def fprint(self, *args, sep=' ', end='\n', flush=False):
         self.open()
+        text = sep.join(map(str, args))
+        self.write(self.now() + sep + text + end, (self.fout,))
+        if self.sink is not None: self.sink.write({'time': time.time(), 'text': text})
+        if flush: self.flush()
 
-        now = f'{self.now():25}'
-
-        for fp in [self.fout]:
-            print(now, *args, **kwargs, file=fp)
-            fp.flush()
 
-
-    def print(self, *args, **kwargs):
+    def print(self, *args, sep=' ', end='\n', flush=False):
         self.open()
+        text = sep.join(map(str, args))
+        self.write(self.now() + sep + text + end, (sys.stdout, self.fout))
+        if self.sink is not None: self.sink.write({'time': time.time(), 'text': text})
+        if flush: self.flush()
 
-        now = f'{self.now():25}'
 
-        for fp in [sys.stdout, self.fout]:
-            print(now, *args, **kwargs, file=fp)
-            fp.flush()
+    def log(self, step=None, **values):
+        """Write a structured record, e.g. printer.log(step, loss=loss, lr=lr)."""
+        record = {'time': time.time(), **values}
+        if step is not None: record['step'] = step
+        self.sink.write(record)
 
 
     def pprint(self, python_dict, stdout=True):
         self.open()
-
-        now = f'{self.now():25}'
-
-        for fp in ([sys.stdout, self.fout] if stdout else [self.fout]):
-            pprint(python_dict, fp)
-            fp.flush()
+        self.write(pformat(python_dict) + '\n', (sys.stdout, self.fout) if stdout else (self.fout,))
+
+
+    def flush(self):
+        """Wait until everything printed so far is written and flushed."""
+        if self.sink is not None: self.sink.flush()
+        if self.queue is None: return
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+
+
+    def close(self):
+        if self.own_sink: self.sink.close()
+        if self.fout is None: return
+        if self.queue is not None:
+            # A second Ctrl-C must not cut the final flush short.
+            with NoInterrupt() if threading.current_thread() is threading.main_thread() else nullcontext():
+                self.queue.put(None)
+                self.thread.join()
+            self.queue = None
+            atexit.unregister(self.close)
+        self.fout.close()
+        self.fout = None
 
     def __contains__(self, key):
         return hasattr(self, key)
@@ -124,19 +653,194 @@ class Printer(object):
 
 
 ##################################################################################
-def save_codes(pattern, target_dir):
-    mkdir(target_dir)
-
-    for filename in glob(pattern):
-        basename = os.path.basename(filename)
-
-        with open(filename) as fin, \
-             open(f'{target_dir}/{basename}', 'w') as fout:
-            fout.write(fin.read())
+def save_codes(pattern, target_dir, store=None, link=True, num_workers=8):
+    """
+    Snapshot the files matching `pattern` (a glob or a list of globs; `**` recurses) into
+    target_dir, keeping their paths relative to the pattern's directory. Files are copied as
+    bytes, `num_workers` at a time.
+    With `store` (a BlobStore or its root), each unique file content is stored once in the shared
+    store: target_dir gets a manifest.json mapping paths to blob digests, plus hard links to the
+    blobs with `link`, so snapshotting unchanged code again costs a stat per file.
+    Hard-linked files share the blob, so do not edit them in place. Returns {path: source}.
+    =============================================================================
+    Example usage:
+
+    >>> save_codes(['*.py', 'models/**/*.py', 'configs/*.yaml'], f'{run_dir}/code', store='~/runs/_store')
+    """
+    from .store import BlobStore
 
+    mkdir(target_dir)
+    files = dict()
+    for p in [pattern] if isinstance(pattern, str) else pattern:
+        root = p.split('*')[0].split('?')[0].split('[')[0]
+        root = root if root.endswith('/') else os.path.dirname(root)
+        for filename in glob(p, recursive=True):
+            if os.path.isfile(filename):
+                files[os.path.relpath(filename, root or '.')] = filename
+    if isinstance(store, str): store = BlobStore(store)
+
+    def save(item):
+        path, filename = item
+        target = os.path.join(target_dir, path)
+        mkdir(os.path.dirname(target))
+        # target may be a hard link into a store from an earlier snapshot: replace it, never write through it.
+        if os.path.lexists(target): os.remove(target)
+        if store is None:
+            copyfile(filename, target)
+            return None
+        blob = store.put_file(filename, ext='')
+        if link:
+            try:
+                os.link(blob, target)
+            except OSError:
+                copyfile(blob, target)  # store on another filesystem
+        return os.path.basename(blob)
+
+    digests = parmap(save, list(files.items()), nprocs=num_workers, backend='thread')
+    if store is not None:
+        with open(os.path.join(target_dir, 'manifest.json'), 'w') as fp:
+            json.dump({'store': store.root, 'files': dict(zip(files, digests))}, fp, indent=1)
+    return files
+
+
+class CheckpointIndex(object):
+    """
+    Manifest of the checkpoints in `ckpt_dir` (checkpoints.json), updated by register() after each
+    save, so finding the latest or best checkpoint costs one stat and no directory listing.
+    Readers in other processes reload the manifest only when it changed.
+    Retention: only the `keep_last` most recent checkpoints plus the `keep_best` best by `metric`
+    ('min' or 'max' per `mode`) are kept on disk; None keeps everything.
+    =============================================================================
+    Example usage:
+
+    >>> index = CheckpointIndex('ckpts', keep_last=3, keep_best=1, metric='val_loss')
+    >>> torch.save(model.state_dict(), f'ckpts/{step:08d}.pt')
+    >>> index.register(f'ckpts/{step:08d}.pt', step=step, val_loss=val_loss)
+    >>> latest_checkpoint('ckpts'), index.best()
+    """
+    MANIFEST = 'checkpoints.json'
+
+    def __init__(self, ckpt_dir, keep_last=None, keep_best=None, metric=None, mode='min'):
+        assert mode in {'min', 'max'}, mode
+        assert keep_best is None or metric is not None, 'keep_best needs a metric'
+        self.ckpt_dir = ckpt_dir
+        self.manifest = os.path.join(ckpt_dir, self.MANIFEST)
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.metric = metric
+        self.mode = mode
+        self.entries = []
+        self.version = None
+
+    def load(self):
+        """Reload the manifest if it changed on disk; returns the entries, oldest first."""
+        try:
+            st = os.stat(self.manifest)
+        except FileNotFoundError:
+            self.entries, self.version = [], None
+            return self.entries
+        version = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if version != self.version:
+            with open(self.manifest) as fp:
+                self.entries = json.load(fp)['checkpoints']
+            self.version = version
+        return self.entries
+
+    def save(self):
+        tmp = f'{self.manifest}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump({'checkpoints': self.entries}, fp, indent=1)
+        os.replace(tmp, self.manifest)
+        self.version = None
+
+    def register(self, filename, step=None, **metrics):
+        """Record a checkpoint just saved under ckpt_dir, then apply the retention policy."""
+        mkdir(self.ckpt_dir)
+        entries = [e for e in self.load() if e['name'] != os.path.basename(filename)]
+        entries.append(dict(name=os.path.basename(filename), time=time.time(), step=step, metrics=metrics))
+        self.entries = entries
+        removed = self.retain()
+        self.save()
+        for name in removed:
+            path = os.path.join(self.ckpt_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+        return os.path.join(self.ckpt_dir, os.path.basename(filename))
+
+    def retain(self):
+        """Drop the entries the retention policy does not keep; returns their names."""
+        if self.keep_last is None and self.keep_best is None: return []
+        keep = set()
+        if self.keep_last is not None:
+            keep.update(e['name'] for e in self.entries[len(self.entries) - self.keep_last:] if self.keep_last)
+        if self.keep_best is not None:
+            keep.update(e['name'] for e in self.ranked()[:self.keep_best])
+        removed = [e['name'] for e in self.entries if e['name'] not in keep]
+        self.entries = [e for e in self.entries if e['name'] in keep]
+        return removed
+
+    def ranked(self, metric=None):
+        metric = metric or self.metric
+        entries = [e for e in self.entries if e['metrics'].get(metric) is not None]
+        return sorted(entries, key=lambda e: e['metrics'][metric], reverse=self.mode == 'max')
+
+    def latest(self, pattern='*'):
+        for e in reversed(self.load()):
+            path = os.path.join(self.ckpt_dir, e['name'])
+            if fnmatch(e['name'], pattern) and os.path.exists(path):
+                return path
+        return None
+
+    def best(self, metric=None):
+        self.load()
+        ranked = self.ranked(metric)
+        return os.path.join(self.ckpt_dir, ranked[0]['name']) if ranked else None
+
+
+_checkpoint_indices = dict()
+_checkpoint_scans = dict()
 
 def latest_checkpoint(ckpt_dir, pattern='*', basename=False):
-    ret = max(glob(f'{ckpt_dir}/{pattern}'), key=os.path.getctime)
+    """
+    Most recent checkpoint in ckpt_dir matching `pattern`. Uses the CheckpointIndex manifest when
+    there is one, which makes the lookup O(1); otherwise the newest match by ctime. The list of
+    matches comes from one os.scandir pass, redone only when the directory itself changed, but each
+    match is still stat'ed on every call (an overwrite in place changes neither the directory nor
+    the newest file), so without a manifest a lookup costs one stat per matching file.
+    """
+    index = _checkpoint_indices.get(ckpt_dir)
+    if index is None: index = _checkpoint_indices[ckpt_dir] = CheckpointIndex(ckpt_dir)
+    ret = index.latest(pattern)
+
+    if ret is None and '/' in pattern:
+        ret = max(glob(f'{ckpt_dir}/{pattern}'), key=os.path.getctime)
+
+    elif ret is None:
+        version = os.stat(ckpt_dir).st_mtime_ns
+        cached = _checkpoint_scans.get((ckpt_dir, pattern))
+        entries = []
+        if cached is not None and cached[0] == version:
+            # Overwriting a checkpoint in place changes its ctime but not the directory's mtime.
+            for path in cached[1]:
+                try:
+                    entries.append((os.stat(path).st_ctime, path))
+                except FileNotFoundError:
+                    pass
+        else:
+            with os.scandir(ckpt_dir) as it:
+                for e in it:
+                    if not fnmatch(e.name, pattern) or e.name == CheckpointIndex.MANIFEST: continue
+                    if e.name.startswith('.') and not pattern.startswith('.'): continue
+                    try:
+                        entries.append((e.stat().st_ctime, e.path))
+                    except FileNotFoundError:
+                        pass
+            _checkpoint_scans[(ckpt_dir, pattern)] = (version, [path for _, path in entries])
+        if not entries: raise ValueError(f'No checkpoint matching `{pattern}` in {ckpt_dir}')
+        ret = max(entries)[1]
+
     if basename:
         ret = os.path.basename(ret)
-    return ret
\ No newline at end of file
+    return ret
@@ -22,7 +22,10 @@ def subplots(rows, cols, dpi=100, keep_dim=False, flatten=False, figsize=3, aspe
     return fig, ax
 
 
-def compact(fig=plt.gcf(), ax=plt.gca(), padding=0, margin=0, h_margin=0, w_margin=0, ticks=False):
+def compact(fig=None, ax=None, padding=0, margin=0, h_margin=0, w_margin=0, ticks=False):
+    """Defaults to the current figure and axes."""
+    if fig is None: fig = plt.gcf()
+    if ax is None: ax = fig.gca()
     if not ticks:
         for a in np.reshape([ax], -1):
             a.axis('off')
@@ -0,0 +1,124 @@
+import os
+import json
+import hashlib
+import threading
+
+import numpy as np
+
+from .system import copyfile
+
+
+##################################################################################
+def new_hash():
+    return hashlib.blake2b(digest_size=16)
+
+
+def array_digest(array, *extra):
+    """Hash an array's bytes, shape and dtype, plus any `extra` values (e.g. encoding options)."""
+    array = np.ascontiguousarray(array)
+    h = new_hash()
+    h.update(repr((array.shape, array.dtype.str) + extra).encode())
+    h.update(array.data)
+    return h.hexdigest()
+
+
+def combine_digests(digests, *extra):
+    h = new_hash()
+    h.update(repr(extra).encode())
+    for digest in digests:
+        h.update(digest.encode())
+    return h.hexdigest()
+
+
+class BlobStore(object):
+    """
+    Content-addressed file store: each unique blob is kept once at <root>/<digest[:2]>/<digest><ext>.
+    Blobs are written to a temporary file and renamed into place, so several threads or processes
+    can share one store. Digests of source files are remembered in <root>/index.jsonl, keyed by
+    (path, size, mtime), so unchanged files are not re-hashed on later runs.
+    =============================================================================
+    Example usage:
+
+    >>> store = BlobStore('~/www/_store')
+    >>> path = store.put_file('model.py', ext='.py')
+    >>> digest = array_digest(image)
+    >>> path = store.path(digest, '.png')
+    >>> if store.claim(path): store.write(path, lambda tmp: cv2.imwrite(tmp, image))
+    """
+    def __init__(self, root):
+        self.root = os.path.expanduser(root)
+        os.makedirs(self.root, exist_ok=True)
+        self.index_file = os.path.join(self.root, 'index.jsonl')
+        self.lock = threading.Lock()
+        self.claimed = set()
+        self.writing = dict()  # path -> Event set once its claimed write has finished
+        self.index = dict()
+        if os.path.isfile(self.index_file):
+            with open(self.index_file) as fp:
+                for line in fp:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # torn line from a concurrent writer
+                    self.index[tuple(entry['key'])] = entry['digest']
+
+    def path(self, digest, ext=''):
+        return os.path.join(self.root, digest[:2], digest + ext)
+
+    def claim(self, path):
+        """
+        Return True if the caller should write `path`, i.e. it is neither stored nor being written.
+        Callers that get False and need the blob itself wait(path) for a write still in flight.
+        """
+        with self.lock:
+            if path in self.claimed: return False
+            self.claimed.add(path)
+            if os.path.exists(path): return False
+            self.writing[path] = threading.Event()
+        return True
+
+    def wait(self, path):
+        event = self.writing.get(path)
+        if event is not None: event.wait()
+        return path
+
+    def write(self, path, write_fn):
+        """Atomically create `path` through `write_fn(tmp_path)`; the temp file keeps the extension."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        root, ext = os.path.splitext(path)
+        tmp = f'{root}.{os.getpid()}.{threading.get_ident()}.tmp{ext}'
+        try:
+            write_fn(tmp)
+            os.replace(tmp, path)
+        except BaseException:
+            with self.lock: self.claimed.discard(path)  # let a later claim retry
+            raise
+        finally:
+            if os.path.exists(tmp): os.remove(tmp)
+            with self.lock: event = self.writing.pop(path, None)
+            if event is not None: event.set()
+        return path
+
+    def file_digest(self, filename, *extra):
+        st = os.stat(filename)
+        key = (os.path.abspath(filename), st.st_size, st.st_mtime_ns)
+        digest = self.index.get(key)
+        if digest is None:
+            h = new_hash()
+            with open(filename, 'rb') as fp:
+                for chunk in iter(lambda: fp.read(1 << 20), b''):
+                    h.update(chunk)
+            digest = h.hexdigest()
+            with self.lock:
+                self.index[key] = digest
+                with open(self.index_file, 'a') as fp:
+                    fp.write(json.dumps({'key': key, 'digest': digest}) + '\n')
+        return digest if not extra else combine_digests([digest], *extra)
+
+    def put_file(self, filename, ext=None):
+        """Store a copy of `filename` and return its path in the store."""
+        if ext is None: ext = os.path.splitext(filename)[1]
+        path = self.path(self.file_digest(filename), ext)
+        if self.claim(path):
+            self.write(path, lambda tmp: copyfile(filename, tmp))
+        return self.wait(path)
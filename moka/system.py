@@ -1,13 +1,50 @@
 import argparse
 import os, sys
+import shlex
+import shutil
+import subprocess
 
 ##################################################################################
+_created_dirs = set()
+
 def mkdir(dirname):
-    os.system(f'mkdir -p {dirname}')
+    """mkdir -p, in-process. A directory this process already created costs a single stat."""
+    if not dirname: return
+    dirname = os.path.abspath(os.path.expanduser(dirname))
+    if dirname in _created_dirs and os.path.isdir(dirname): return
+    os.makedirs(dirname, exist_ok=True)
+    _created_dirs.add(dirname)
+
+def shell(cmd, verbose=True, check=False, capture=False, timeout=None, cwd=None):
+    """
+    Run `cmd` and return its subprocess.CompletedProcess. A string goes through /bin/sh
+    (pipes, globs, multi-line scripts); a list of arguments is run directly, so paths need no quoting.
+    `capture` collects stdout/stderr as text, `check` raises CalledProcessError on a non-zero exit,
+    and `timeout` (seconds) kills the command with TimeoutExpired.
+    """
+    if verbose: print(cmd if isinstance(cmd, str) else shlex.join(cmd))
+    return subprocess.run(cmd, shell=isinstance(cmd, str), check=check, capture_output=capture,
+                          text=capture or None, timeout=timeout, cwd=cwd)
 
-def shell(cmd, verbose=True):
-    if verbose: print(cmd)
-    os.system(cmd)
+def copyfile(src, dst):
+    """
+    Copy file `src` to `dst` (a file or directory) and return the destination path.
+    On filesystems supporting it (btrfs, xfs) the copy is a reflink sharing blocks with `src`;
+    otherwise shutil copies in the kernel through sendfile.
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        # also a hard link or symlink to src: opening it for writing would truncate the source
+        raise shutil.SameFileError(f'{src!r} and {dst!r} are the same file')
+    try:
+        import fcntl
+        with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+            fcntl.ioctl(fout.fileno(), 0x40049409, fin.fileno())  # FICLONE
+        shutil.copymode(src, dst)
+    except (ImportError, OSError):
+        shutil.copyfile(src, dst)
+    return dst
 
 def ask(question, options=['y', 'n']):
     ans = None
@@ -56,30 +93,620 @@ class NoInterrupt(object):
 
 
 ##################################################################################
+import fcntl
+import threading
+
+class AtomicCounter(object):
+    """Thread-safe counter handing out consecutive integers."""
+    def __init__(self, start=0):
+        self.value = start
+        self.lock = threading.Lock()
+
+    def next(self):
+        with self.lock:
+            value = self.value
+            self.value += 1
+        return value
+
+
+class FileCounter(object):
+    """
+    Counter shared by threads and processes through a small file guarded by flock.
+    `start` (an int, or a function returning one) initializes the file if it does not exist yet.
+    Each process reserves `block` values per lock, so values are unique but may leave gaps.
+    """
+    def __init__(self, filename, start=0, block=1):
+        self.filename = filename
+        self.start = start
+        self.block = block
+        self.lock = threading.Lock()
+        self.value = self.end = 0
+
+    def reserve(self):
+        with open(self.filename, 'a+') as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                fp.seek(0)
+                content = fp.read().strip()
+                if content:
+                    value = int(content)
+                else:
+                    value = self.start() if callable(self.start) else self.start
+                fp.seek(0)
+                fp.truncate()
+                fp.write(str(value + self.block))
+                fp.flush()
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+        self.value, self.end = value, value + self.block
+
+    def next(self):
+        with self.lock:
+            if self.value >= self.end: self.reserve()
+            value = self.value
+            self.value += 1
+        return value
+
+
+##################################################################################
+import time
+import queue
+import pickle
+import itertools
+import traceback
+from collections import deque
 import multiprocessing
 
-def fun(f, q_in, q_out):
+def map_arrays(obj, fn, cls):
+    """Rebuild obj with fn applied to its `cls` leaves, looking inside lists, tuples and dicts."""
+    if isinstance(obj, cls):
+        return fn(obj)
+    if type(obj) in (list, tuple):
+        return type(obj)([map_arrays(x, fn, cls) for x in obj])
+    if type(obj) is dict:
+        return {k: map_arrays(v, fn, cls) for k, v in obj.items()}
+    return obj
+
+
+class SharedArray(object):
+    __slots__ = ('offset', 'shape', 'dtype')
+
+    def __init__(self, offset, shape, dtype):
+        self.offset, self.shape, self.dtype = offset, shape, dtype
+
+    def __getstate__(self):
+        return (self.offset, self.shape, self.dtype)
+
+    def __setstate__(self, state):
+        self.offset, self.shape, self.dtype = state
+
+
+class SharedChunk(object):
+    """
+    A list of items whose ndarray leaves are moved into a single shared memory block, so that
+    only small descriptors (offset, shape, dtype) are pickled through the queues.
+    The receiver either maps the arrays in place (attach) or copies them out and frees the block (load).
+    """
+    def __init__(self, items):
+        import numpy as np
+        from multiprocessing import shared_memory
+
+        arrays = []
+        def find(a):
+            if not a.dtype.hasobject: arrays.append(a)
+            return a
+        map_arrays(items, find, np.ndarray)
+
+        self.name = None
+        self.items = items
+        if not arrays: return
+
+        offsets, size = dict(), 0
+        for a in arrays:
+            offsets[id(a)] = size
+            size += (a.nbytes + 63) // 64 * 64
+        block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+
+        def put(a):
+            if id(a) not in offsets: return a
+            np.ndarray(a.shape, a.dtype, buffer=block.buf, offset=offsets[id(a)])[...] = a
+            return SharedArray(offsets[id(a)], a.shape, a.dtype.str)
+        self.items = map_arrays(items, put, np.ndarray)
+        self.name = block.name
+        block.close()
+
+    def attach(self):
+        """Return (block, items) with arrays viewing the shared block; close the block once they are dropped."""
+        import numpy as np
+        from multiprocessing import shared_memory
+
+        if self.name is None: return None, self.items
+        block = shared_memory.SharedMemory(name=self.name)
+        view = lambda d: np.ndarray(d.shape, d.dtype, buffer=block.buf, offset=d.offset)
+        return block, map_arrays(self.items, view, SharedArray)
+
+    def load(self):
+        """Return the items with arrays copied out of shared memory, and free the block."""
+        import numpy as np
+
+        block, items = self.attach()
+        if block is None: return items
+        items = map_arrays(items, np.copy, np.ndarray)
+        block.close()
+        block.unlink()
+        return items
+
+    def free(self):
+        from multiprocessing import shared_memory
+
+        if self.name is None: return
+        try:
+            block = shared_memory.SharedMemory(name=self.name)
+        except FileNotFoundError:
+            return  # already freed by the worker that consumed it
+        block.close()
+        block.unlink()
+
+
+class TaskError(object):
+    """Marks an item on which `f` failed: holds the exception and the traceback formatted where it was raised."""
+    def __init__(self, exception, tb=None):
+        self.tb = tb if tb is not None else traceback.format_exc()
+        try:
+            pickle.dumps(exception)
+        except Exception:
+            exception = RuntimeError(repr(exception))
+        self.exception = exception
+
+    def to_exception(self):
+        self.exception.__cause__ = RemoteTraceback(self.tb)
+        return self.exception
+
+
+class RemoteTraceback(Exception):
+    def __init__(self, tb):
+        self.tb = tb
+
+    def __str__(self):
+        return self.tb
+
+
+class WorkerCrashed(RuntimeError):
+    pass
+
+
+def call(g, x):
+    try:
+        return g(x)
+    except Exception as e:
+        return TaskError(e)
+
+
+def fun(f, q_in, q_out, idx=0, current=None, started=None):
+    cache = (None, None)
     while True:
-        i, x = q_in.get()
-        if i is None:
+        task = q_in.get()
+        if task is None:
             break
-        q_out.put((i, f(x)))
+        i, g, chunk = task
+        if current is not None:
+            current[idx], started[idx] = i, time.time()
+        if g is None:
+            g = f
+        else:
+            if cache[0] != g: cache = (g, pickle.loads(g))
+            g = cache[1]
+
+        start = time.perf_counter()
+        block = None
+        if isinstance(chunk, SharedChunk):
+            block, chunk = chunk.attach()
+        res = [call(g, x) for x in chunk]
+        n = len(chunk)
+        if block is not None:
+            res = SharedChunk(res)  # copies results out of any views into `block`
+            del chunk
+            try:
+                block.close()
+            except BufferError:
+                pass  # f kept a view on its input; the mapping lives until the worker exits
+            block.unlink()
+
+        if current is not None:
+            # Sending: the worker may hold the queue's write lock, so timeouts must not kill it now.
+            started[idx] = float('inf')
+        try:
+            q_out.put((i, res, time.perf_counter() - start))
+        except Exception as e:
+            if isinstance(res, SharedChunk): res.free()
+            q_out.put((i, [TaskError(e)] * n, time.perf_counter() - start))
+        if current is not None:
+            current[idx] = -1
+
+
+class Pool(object):
+    """
+    Persistent process pool behind parmap. Items are sent to workers in chunks; unless `chunksize`
+    is fixed, the chunk size is tuned from measured task times so that a chunk takes ~`target_time` seconds.
+    `f` is handed to the workers at fork time (so it may be a lambda); other functions passed to
+    map() are pickled along with each chunk.
+    With `shm=True`, ndarrays in items and results (also inside tuples/lists/dicts) travel through
+    shared memory blocks instead of being pickled.
 
+    Failures: an exception raised by `f` is re-raised in the caller with the worker's traceback as its
+    cause, or returned in place of the result with errors='return'. Crashed workers are respawned and
+    their chunk is retried item by item up to `retries` times; a worker spending more than `timeout`
+    seconds per item is killed and handled the same way.
+    =============================================================================
+    Example usage:
 
-def parmap(f, X, nprocs=multiprocessing.cpu_count()):
-    q_in = multiprocessing.Queue(1)
-    q_out = multiprocessing.Queue()
+    >>> with Pool(8, f) as pool:
+    >>>     for X in batches:
+    >>>         Y = parmap(f, X, pool=pool)
+    """
+    def __init__(self, nprocs=multiprocessing.cpu_count(), f=None, chunksize=None, target_time=0.05, shm=False,
+                 retries=0, timeout=None, errors='raise'):
+        assert errors in {'raise', 'return'}, errors
+        self.f = f
+        self.shm = shm
+        self.nprocs = nprocs
+        self.chunksize = chunksize
+        self.target_time = target_time
+        self.retries = retries
+        self.timeout = timeout
+        self.errors = errors
+        self.item_time = None
+        self.last_f = None
+        self.task_id = 0
+        if shm:
+            # Workers must share our resource tracker, or blocks created in one process and unlinked
+            # in another are reported as leaked at shutdown.
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+        self.q_in = multiprocessing.Queue()
+        # Workers write results synchronously, so nothing they sent is lost if they crash later;
+        # a thread moves them into a local queue that supports timeouts.
+        self.q_out = multiprocessing.SimpleQueue()
+        self.results = queue.Queue()
+        self.reader = threading.Thread(target=self.read_results, daemon=True)
+        self.reader.start()
+        self.chunks = dict()  # task id -> SharedChunk input not yet consumed by a worker
+        self.current = multiprocessing.Array('q', [-1] * nprocs, lock=False)
+        self.started = multiprocessing.Array('d', nprocs, lock=False)
+        self.proc = [self.spawn(idx) for idx in range(nprocs)]
 
-    proc = [multiprocessing.Process(target=fun, args=(f, q_in, q_out))
-            for _ in range(nprocs)]
-    for p in proc:
+    def spawn(self, idx):
+        self.current[idx] = -1
+        p = multiprocessing.Process(target=fun, args=(self.f, self.q_in, self.q_out, idx, self.current, self.started))
         p.daemon = True
         p.start()
+        return p
+
+    def read_results(self):
+        while True:
+            msg = self.q_out.get()
+            if msg is None: break
+            self.results.put(msg)
+
+    def next_chunksize(self, remaining=None):
+        if self.chunksize: return self.chunksize
+        if self.item_time is None: return 1
+        size = max(1, int(self.target_time / max(self.item_time, 1e-9)))
+        if remaining is not None:
+            # Keep a few chunks per worker so the tail stays balanced.
+            size = min(size, max(1, remaining // (4 * self.nprocs)))
+        return size
+
+    def update(self, item_time):
+        self.item_time = item_time if self.item_time is None else 0.8 * self.item_time + 0.2 * item_time
+
+    def send(self, g, items):
+        task_id = self.task_id
+        self.task_id += 1
+        if self.shm: items = self.chunks[task_id] = SharedChunk(items)
+        self.q_in.put((task_id, g, items))
+        return task_id
+
+    def free_input(self, task_id):
+        chunk = self.chunks.pop(task_id, None)
+        if chunk is not None: chunk.free()
+
+    def lost_tasks(self, pending):
+        """Respawn dead workers and kill timed out ones; return the ids of the tasks they were running."""
+        lost = []
+        now = time.time()
+        for idx, p in enumerate(self.proc):
+            task_id = self.current[idx]
+            if p.is_alive():
+                if self.timeout is None or task_id not in pending: continue
+                if now - self.started[idx] < self.timeout * len(pending[task_id][1]): continue  # or sending
+                p.kill()
+                p.join()
+                error = TimeoutError(f'item took more than {self.timeout}s')
+            else:
+                error = WorkerCrashed(f'worker exited with code {p.exitcode}')
+            self.proc[idx] = self.spawn(idx)
+            if task_id in pending:
+                lost.append((task_id, error))
+        return lost
+
+    def map(self, f, X, chunksize=None, errors=None):
+        return list(self.imap(f, X, chunksize, errors=errors))
+
+    def imap(self, f, X, chunksize=None, ordered=True, window=None, progress=False, errors=None):
+        """
+        Lazily map `f` over the iterable `X`, yielding results as chunks complete: in input order
+        through a reorder buffer, or as soon as they arrive with ordered=False.
+        At most `window` chunks (default 2 per worker) are in flight or buffered, so memory stays
+        bounded however long `X` is. `progress` shows a tqdm bar.
+        """
+        if f is not self.last_f: self.item_time = None
+        self.last_f = f
+        # Pickle here once, so an unpicklable f fails loudly instead of inside the queue's feeder thread.
+        g = None if f is self.f else pickle.dumps(f)
+        chunksize = chunksize or self.chunksize
+        window = window or 2 * self.nprocs
+        errors = errors or self.errors
+        n = len(X) if hasattr(X, '__len__') else None
+        it = iter(X)
+
+        if progress:
+            from tqdm import tqdm
+            bar = tqdm(total=n)
+
+        pending, buffer, failed = dict(), dict(), []  # pending: task id -> (start, items, tries)
+        sent, done, exhausted = 0, 0, False
+        last_check = time.time()
+        try:
+            while True:
+                while not exhausted and len(pending) + len(buffer) < window:
+                    size = chunksize or self.next_chunksize(None if n is None else n - sent)
+                    chunk = list(itertools.islice(it, size))
+                    if not chunk:
+                        exhausted = True
+                        break
+                    pending[self.send(g, chunk)] = (sent, chunk, 0)
+                    sent += len(chunk)
+                if not pending and not failed:
+                    break
+
+                if failed:
+                    start, res = failed.pop()
+                else:
+                    try:
+                        i, res, elapsed = self.results.get(timeout=0.1)
+                    except queue.Empty:
+                        i = None
+                    if time.time() - last_check > 0.1 or i is None:
+                        last_check = time.time()
+                        for task_id, error in self.lost_tasks(pending):
+                            self.free_input(task_id)
+                            start, items, tries = pending.pop(task_id)
+                            if tries < self.retries:
+                                # Retry one item per task, so a single bad item cannot sink the others.
+                                for j, x in enumerate(items):
+                                    pending[self.send(g, [x])] = (start + j, [x], tries + 1)
+                            else:
+                                failed.append((start, [TaskError(error, '')] * len(items)))
+                    if i is None: continue
+                    self.chunks.pop(i, None)  # the worker freed it
+                    if i not in pending:
+                        # left over from an abandoned imap, or from a task we already retried
+                        if isinstance(res, SharedChunk): res.free()
+                        continue
+                    start = pending.pop(i)[0]
+                    if isinstance(res, SharedChunk): res = res.load()
+                    self.update(elapsed / len(res))
+
+                for j, y in enumerate(res):
+                    if isinstance(y, TaskError):
+                        if errors == 'raise': raise y.to_exception()
+                        res[j] = y.to_exception()
+                if progress: bar.update(len(res))
+
+                if not ordered:
+                    yield from res
+                    continue
+                buffer[start] = res
+                while done in buffer:
+                    res = buffer.pop(done)
+                    done += len(res)
+                    yield from res
+        finally:
+            if progress: bar.close()
+            if pending: self.abort()
+
+    def abort(self):
+        """
+        Stop the tasks of an abandoned imap (error, KeyboardInterrupt or closed generator): kill the workers,
+        drop the chunks still queued, free their shared memory and start fresh workers.
+        """
+        sending = lambda idx: self.current[idx] != -1 and self.started[idx] == float('inf')
+        deadline = time.time() + 1
+        while any(sending(idx) for idx in range(self.nprocs)) and time.time() < deadline:
+            time.sleep(0.01)  # let results being sent through q_out finish, so the pipe stays intact
+        for p in self.proc:
+            p.kill()
+        for p in self.proc:
+            p.join()
+        # A killed worker may hold the read lock of q_in, so it is replaced along with its queued chunks.
+        self.q_in.cancel_join_thread()
+        self.q_in.close()
+        self.q_in = multiprocessing.Queue()
+        for task_id in list(self.chunks):
+            self.free_input(task_id)
+        self.proc = [self.spawn(idx) for idx in range(self.nprocs)]
+
+    def close(self, timeout=5):
+        for _ in self.proc:
+            self.q_in.put(None)
+        for p in self.proc:
+            p.join(timeout)
+            if p.is_alive():
+                p.kill()
+                p.join()
+        self.proc = []
+        self.q_out.put(None)
+        self.reader.join()
+        while not self.results.empty():
+            res = self.results.get()[1]
+            if isinstance(res, SharedChunk): res.free()
+        for task_id in list(self.chunks):
+            self.free_input(task_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class ThreadPool(object):
+    """
+    Thread backend for parmap, for I/O-bound f (image reads, copies, stat calls): no forking,
+    and f need not be picklable. Items are submitted one by one; ordering, windowing, progress
+    and `errors` behave as in Pool.imap. Threads cannot be killed, so there is no `timeout`.
+    """
+    def __init__(self, nthreads=multiprocessing.cpu_count(), errors='raise'):
+        from concurrent.futures import ThreadPoolExecutor
+        assert errors in {'raise', 'return'}, errors
+        self.nprocs = nthreads
+        self.errors = errors
+        self.executor = ThreadPoolExecutor(nthreads)
+
+    def submit(self, f, x):
+        return self.executor.submit(f, x)
+
+    def map(self, f, X, chunksize=None, errors=None):
+        return list(self.imap(f, X, errors=errors))
+
+    def imap(self, f, X, chunksize=None, ordered=True, window=None, progress=False, errors=None):
+        """Like Pool.imap, with at most `window` items (default 4 per thread) in flight; `chunksize` is ignored."""
+        from concurrent.futures import wait, FIRST_COMPLETED
+        window = window or 4 * self.nprocs
+        errors = errors or self.errors
+        it = iter(X)
+
+        if progress:
+            from tqdm import tqdm
+            bar = tqdm(total=len(X) if hasattr(X, '__len__') else None)
+
+        pending = deque()
+        try:
+            while True:
+                pending.extend(self.submit(f, x) for x in itertools.islice(it, window - len(pending)))
+                if not pending:
+                    break
+                if ordered:
+                    done = [pending.popleft()]
+                else:
+                    done = wait(pending, return_when=FIRST_COMPLETED).done
+                    for fut in done: pending.remove(fut)
+                for fut in done:
+                    try:
+                        y = fut.result()
+                    except Exception as e:
+                        if errors == 'raise': raise
+                        y = e
+                    if progress: bar.update(1)
+                    yield y
+        finally:
+            for fut in pending: fut.cancel()
+            if progress: bar.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class AsyncPool(ThreadPool):
+    """
+    Asyncio backend for parmap: f may be a coroutine function, of which at most `concurrency`
+    calls run at once on an event loop in a background thread (so it also works when called
+    from async code). A call taking more than `timeout` seconds is cancelled and fails with TimeoutError.
+    =============================================================================
+    Example usage:
+
+    >>> async def fetch(url): ...
+    >>> pages = parmap(fetch, urls, nprocs=64, backend='asyncio')
+    """
+    def __init__(self, concurrency=multiprocessing.cpu_count(), timeout=None, errors='raise'):
+        import asyncio
+        assert errors in {'raise', 'return'}, errors
+        self.nprocs = concurrency
+        self.timeout = timeout
+        self.errors = errors
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.semaphore = self.run(self.make_semaphore())
+
+    async def make_semaphore(self):
+        import asyncio
+        return asyncio.Semaphore(self.nprocs)
+
+    def run(self, coro):
+        import asyncio
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def call(self, f, x):
+        import asyncio
+        async with self.semaphore:
+            y = f(x)
+            if asyncio.iscoroutine(y):
+                y = await asyncio.wait_for(y, self.timeout)
+            return y
+
+    def submit(self, f, x):
+        import asyncio
+        return asyncio.run_coroutine_threadsafe(self.call(f, x), self.loop)
+
+    async def cancel_all(self):
+        import asyncio
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in tasks: task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        if self.loop.is_closed(): return
+        self.run(self.cancel_all())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+BACKENDS = {'process': Pool, 'thread': ThreadPool, 'asyncio': AsyncPool}
+
 
-    sent = [q_in.put((i, x)) for i, x in enumerate(X)]
-    [q_in.put((None, None)) for _ in range(nprocs)]
-    res = [q_out.get() for _ in range(len(sent))]
+def parmap(f, X, nprocs=multiprocessing.cpu_count(), pool=None, chunksize=None, progress=False, shm=False,
+           retries=0, timeout=None, errors='raise', backend='process'):
+    """
+    Parallel map(f, X). `backend` is 'process' (CPU-bound f), 'thread' or 'asyncio' (I/O-bound f,
+    coroutine functions for asyncio), with `nprocs` workers, threads or concurrent calls.
+    Pass a pool (Pool, ThreadPool or AsyncPool) to reuse it across calls.
+    """
+    return list(parimap(f, X, nprocs, pool, chunksize, progress=progress, shm=shm,
+                        retries=retries, timeout=timeout, errors=errors, backend=backend))
 
-    [p.join() for p in proc]
 
-    return [x for i, x in sorted(res)]
\ No newline at end of file
+def parimap(f, X, nprocs=multiprocessing.cpu_count(), pool=None, chunksize=None, ordered=True, window=None,
+            progress=False, shm=False, retries=0, timeout=None, errors='raise', backend='process'):
+    """Lazy parmap: consumes X as needed and yields results as they complete (see Pool.imap)."""
+    if pool is not None:
+        yield from pool.imap(f, X, chunksize, ordered, window, progress, errors)
+        return
+    assert backend in BACKENDS, f'Unknown backend `{backend}`, expected one of {list(BACKENDS)}'
+    if backend == 'thread':
+        assert timeout is None, 'the thread backend cannot interrupt f, so it has no timeout'
+        pool = ThreadPool(nprocs, errors)
+    elif backend == 'asyncio':
+        pool = AsyncPool(nprocs, timeout, errors)
+    else:
+        pool = Pool(nprocs, f, chunksize, shm=shm, retries=retries, timeout=timeout, errors=errors)
+    with pool:
+        yield from pool.imap(f, X, ordered=ordered, window=window, progress=progress)
@@ -1,18 +1,158 @@
-from datetime import datetime
+import os
+import time
+import json
+import threading
+import functools
+
 
 class Timer(object):
 
-    def __init__(self):
-        self.start_time = datetime.now()
+    def __init__(self, verbose=True):
+        self.verbose = verbose
+        self.start_time = time.perf_counter()
+        self.time = self.start_time
 
     def tic(self):
-        self.time = datetime.now()
+        self.time = time.perf_counter()
         return self
 
     def toc(self):
-        now = datetime.now()
-        delta = (now - self.time).total_seconds()
-        wall = (now - self.start_time).total_seconds()
-        print(f'Time delta: {delta}s, Wall time: {wall}s')
+        now = time.perf_counter()
+        self.delta = now - self.time
+        self.wall = now - self.start_time
+        if self.verbose: print(f'Time delta: {self.delta}s, Wall time: {self.wall}s')
         self.time = now
         return self
+
+
+##################################################################################
+class Section(object):
+    """A named profiler section: a context manager, or a decorator timing every call."""
+    __slots__ = ('profiler', 'name')
+
+    def __init__(self, profiler, name):
+        self.profiler, self.name = profiler, name
+
+    def __enter__(self):
+        stack = self.profiler.stack()
+        path = f'{stack[-1][0]}/{self.name}' if stack else self.name
+        stack.append((path, time.perf_counter_ns()))
+        return self
+
+    def __exit__(self, type, value, traceback):
+        end = time.perf_counter_ns()
+        path, start = self.profiler.stack().pop()
+        self.profiler.record(path, start, end)
+
+    def __call__(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self:
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+class NullSection(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+    def __call__(self, fn):
+        return fn
+
+NULL_SECTION = NullSection()
+
+
+class Profiler(object):
+    """
+    Hierarchical profiler. Sections nest per thread: a section `step` entered inside `train` is
+    reported as `train/step`. Each path aggregates calls, total, mean and max (perf_counter_ns),
+    from any number of threads. With trace=True every call is also kept as an event for
+    export_chrome_trace (open the file in chrome://tracing or ui.perfetto.dev).
+    A disabled profiler hands out a shared no-op section, and decorators return the function
+    unchanged, so instrumentation can stay in the code.
+    =============================================================================
+    Example usage:
+
+    >>> prof = Profiler(trace=True)
+    >>> @prof.section('forward')
+    >>> def forward(x): ...
+    >>> with prof.section('train'):
+    >>>     for x in batches:
+    >>>         with prof.section('step'): forward(x)
+    >>> print(prof)
+    >>> prof.export_chrome_trace('trace.json')
+    """
+    def __init__(self, enabled=True, trace=False, max_events=1000000):
+        self.enabled = enabled
+        self.trace = trace
+        self.max_events = max_events
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = dict()  # path -> [count, total_ns, max_ns]
+            self.events = []
+            self.origin = time.perf_counter_ns()
+
+    def stack(self):
+        try:
+            return self.local.stack
+        except AttributeError:
+            self.local.stack = []
+            return self.local.stack
+
+    def section(self, name):
+        return Section(self, name) if self.enabled else NULL_SECTION
+
+    __call__ = section
+
+    def record(self, path, start, end):
+        elapsed = end - start
+        with self.lock:
+            stat = self.stats.get(path)
+            if stat is None:
+                self.stats[path] = [1, elapsed, elapsed]
+            else:
+                stat[0] += 1
+                stat[1] += elapsed
+                if elapsed > stat[2]: stat[2] = elapsed
+            if self.trace and len(self.events) < self.max_events:
+                self.events.append((path, threading.get_ident(), start, elapsed))
+
+    def summary(self):
+        """{path: {'count', 'total', 'mean', 'max'}}, times in seconds, sorted by path."""
+        with self.lock:
+            stats = {path: list(self.stats[path]) for path in sorted(self.stats)}
+        return {path: dict(count=count, total=total / 1e9, mean=total / count / 1e9, max=max_ns / 1e9)
+                for path, (count, total, max_ns) in stats.items()}
+
+    def to_string(self):
+        from tabulate import tabulate
+        summary = self.summary()
+        data = []
+        for path, s in summary.items():
+            parent = summary.get(path.rpartition('/')[0])
+            share = f'{100 * s["total"] / parent["total"]:.1f}%' if parent else ''
+            data.append([path, s['count'], s['total'], s['mean'], s['max'], share])
+        return '\n\n' + tabulate(data, headers=['Section', 'Calls', 'Total (s)', 'Mean (s)', 'Max (s)', '% of parent'],
+                                  tablefmt="fancy_grid") + '\n\n'
+
+    def __repr__(self):
+        return self.to_string()
+
+    def export_chrome_trace(self, filename):
+        """Write the recorded events in Chrome trace-event JSON (complete events, microseconds)."""
+        with self.lock:
+            events, origin = list(self.events), self.origin
+        pid = os.getpid()
+        trace = [dict(name=path.rpartition('/')[2], cat=path, ph='X', pid=pid, tid=tid,
+                      ts=(start - origin) / 1000, dur=elapsed / 1000) for path, tid, start, elapsed in events]
+        with open(filename, 'w') as fp:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, fp)
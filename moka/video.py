@@ -1,4 +1,7 @@
 import tempfile
+import threading
+import subprocess
+from queue import Queue
 
 import cv2
 import numpy as np
@@ -14,12 +17,121 @@ class Video(list):
         save_video(filename, self, **kwargs)
 
 
-def save_video(filename, images, fps=20, keep_images=False, verbose=True):
+##################################################################################
+def to_frame(image, size=None):
+    """Convert an image (path or array) to a contiguous HxWx3 uint8 BGR frame.
+    If `size` = (width, height) is given, the frame is resized to it."""
+    if isinstance(image, str):
+        image = cv2.imread(image)
+    if image.dtype != np.uint8:
+        image = np.clip(image, 0, 255).astype(np.uint8)
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    elif image.shape[2] == 4:
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    if size is not None and (image.shape[1], image.shape[0]) != tuple(size):
+        image = cv2.resize(image, tuple(size), interpolation=cv2.INTER_AREA)
+    return np.ascontiguousarray(image)
+
+
+class FFmpegPipe(object):
+    """A single ffmpeg process encoding raw BGR frames written to its stdin."""
+    def __init__(self, filename, size, fps=20, verbose=True):
+        self.filename = filename
+        self.size = tuple(size)
+        width, height = self.size
+        self.cmd = ['ffmpeg', '-y', '-loglevel', 'warning',
+                    '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}',
+                    '-framerate', str(fps), '-i', '-',
+                    '-vcodec', 'libx264', '-pix_fmt', 'yuv420p', filename]
+        if verbose: print(' '.join(self.cmd))
+        # stderr goes to a file rather than a pipe, so a chatty ffmpeg can never block us.
+        self.stderr = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(self.cmd, stdin=subprocess.PIPE,
+                                     stdout=subprocess.DEVNULL, stderr=self.stderr)
+
+    def write(self, image):
+        assert self.proc is not None, f'ffmpeg pipe for `{self.filename}` is closed'
+        frame = to_frame(image, self.size)
+        try:
+            self.proc.stdin.write(frame.data)
+        except BrokenPipeError:
+            # ffmpeg exited early; close() raises with its stderr.
+            self.close()
+            raise RuntimeError(f'ffmpeg exited early while encoding `{self.filename}`')
+
+    def close(self):
+        if self.proc is None: return
+        proc, self.proc = self.proc, None
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = proc.wait()
+        self.stderr.seek(0)
+        stderr = self.stderr.read().decode(errors='replace')
+        self.stderr.close()
+        if returncode != 0:
+            raise RuntimeError(f'ffmpeg failed with exit code {returncode} '
+                               f'while encoding `{self.filename}`:\n{stderr}')
+
+    def kill(self):
+        if self.proc is None: return
+        self.proc.kill()
+        self.proc.wait()
+        self.proc = None
+        self.stderr.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.close()
+        else:
+            self.kill()
+
+
+def save_video(filename, images, fps=20, keep_images=False, verbose=True, stream=True):
+    """Encode `images` (paths or BGR arrays) into an mp4 video.
+
+    With `stream=True` (default), raw frames are piped into a single ffmpeg process and
+    no intermediate files are written (except the kept images if `keep_images`).
+    With `stream=False`, frames are round-tripped through PNG files as before.
+    """
+    if isinstance(images, VideoWriter):
+        images.save(filename)
+        return
+
     assert len(images) > 0, len(images)
     assert filename.endswith('.mp4'), filename
 
+    images_dir = None
+    if keep_images:
+        dirname = os.path.dirname(filename)
+        basename = os.path.splitext(os.path.basename(filename))[0]
+        images_dir = os.path.join(dirname, basename)
+        mkdir(images_dir)
+
+    if stream:
+        pipe = None
+        try:
+            for i, image in enumerate(images):
+                frame = to_frame(image, None if pipe is None else pipe.size)
+                if pipe is None:
+                    pipe = FFmpegPipe(filename, (frame.shape[1], frame.shape[0]), fps, verbose)
+                if images_dir is not None:
+                    cv2.imwrite(f'{images_dir}/{i:06d}.png', frame)
+                pipe.write(frame)
+        except BaseException:
+            if pipe is not None: pipe.kill()
+            raise
+        pipe.close()
+        return
+
     def ffmpeg_cmd(input_pattern, output_filename, fps):
-        return f'ffmpeg -y -loglevel warning -framerate {fps} -i {input_pattern} -vcodec libx264 -pix_fmt yuv420p {filename}'
+        return ['ffmpeg', '-y', '-loglevel', 'warning', '-framerate', str(fps), '-i', input_pattern,
+                '-vcodec', 'libx264', '-pix_fmt', 'yuv420p', output_filename]
 
     if not keep_images:
         with tempfile.TemporaryDirectory() as tempdir:
@@ -28,19 +140,104 @@ def save_video(filename, images, fps=20, keep_images=False, verbose=True):
                     image = cv2.imread(image)
                 cv2.imwrite(f'{tempdir}/{i:06d}.png', image)
             input_pattern = f'{tempdir}/%06d.png'
-            shell(ffmpeg_cmd(input_pattern, filename, fps), verbose)
+            shell(ffmpeg_cmd(input_pattern, filename, fps), verbose, check=True)
 
     else:
-        dirname = os.path.dirname(filename)
-        basename = os.path.splitext(os.path.basename(filename))[0]
-        images_dir = os.path.join(dirname, basename)
-        mkdir(images_dir)
         for i, image in enumerate(images):
             if isinstance(image, str):
                 image = cv2.imread(image)
             cv2.imwrite(f'{images_dir}/{i:06d}.png', image)
         input_pattern = f'{images_dir}/%06d.png'
-        shell(ffmpeg_cmd(input_pattern, filename, fps), verbose)
+        shell(ffmpeg_cmd(input_pattern, filename, fps), verbose, check=True)
+
+
+class VideoWriter(object):
+    """
+    Streaming video writer: frames are encoded by a background thread as they arrive,
+    so at most `queue_size` frames are held in memory.
+    A closed VideoWriter can be used wherever a Video is accepted (e.g. HTMLTable.add_video).
+    =============================================================================
+    Example usage:
+
+    >>> with VideoWriter('rollout.mp4', fps=30) as w:
+    >>>     for frame in frames:
+    >>>         w.write(frame)
+    >>> T.add_row(vid=w)
+    """
+    def __init__(self, filename, fps=20, queue_size=8, verbose=False):
+        assert filename.endswith('.mp4'), filename
+        self.filename = filename
+        self.fps = fps
+        self.verbose = verbose
+        self.size = None
+        self.num_frames = 0
+        self.closed = False
+        self.error = None
+        self.queue = Queue(queue_size)
+        self.thread = threading.Thread(target=self._encode, daemon=True)
+        self.thread.start()
+
+    def _encode(self):
+        pipe = None
+        while True:
+            frame = self.queue.get()
+            if frame is None: break
+            if self.error is not None: continue  # keep draining so write() never blocks
+            try:
+                if pipe is None:
+                    frame = to_frame(frame)
+                    self.size = (frame.shape[1], frame.shape[0])
+                    pipe = FFmpegPipe(self.filename, self.size, self.fps, self.verbose)
+                pipe.write(frame)
+            except Exception as e:
+                self.error = e
+                if pipe is not None: pipe.kill()
+        if pipe is not None and self.error is not None:
+            pipe.kill()  # encoding failed or the `with` body raised: stop ffmpeg instead of finishing the file
+        elif pipe is not None:
+            try:
+                pipe.close()
+            except Exception as e:
+                self.error = e
+
+    def write(self, image):
+        """Queue a frame (path or BGR array); blocks while the queue is full.
+        Arrays are copied, so the caller may reuse its buffer."""
+        assert not self.closed, f'VideoWriter `{self.filename}` is closed'
+        if self.error is not None: raise self.error
+        if isinstance(image, np.ndarray): image = image.copy()
+        self.queue.put(image)
+        self.num_frames += 1
+        return self
+
+    def close(self):
+        """Flush pending frames and wait for the encoder; raises if encoding failed."""
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join()
+        if self.error is not None: raise self.error
+        assert self.num_frames > 0, 'Empty video!'
+
+    def save(self, filename, **kwargs):
+        self.close()
+        if os.path.abspath(filename) != os.path.abspath(self.filename):
+            copyfile(self.filename, filename)
+
+    def __len__(self):
+        return self.num_frames
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.close()
+        elif not self.closed:
+            self.error = self.error or value
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join()
 
 
 def video_size(video_path):